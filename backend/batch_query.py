@@ -0,0 +1,54 @@
+"""Answer a file of questions through the /query/batch endpoint.
+
+Usage:
+    python batch_query.py questions.txt [--api-url URL] [--out answers.ndjson]
+                          [--num-results 4] [--persist]
+
+Questions are read one per line (blank lines skipped). Results are written as
+NDJSON, one line per question, in the order they finish; each line carries the
+question's `index` in the input file.
+"""
+import os
+import sys
+import argparse
+import httpx
+
+API_URL = os.environ.get("API_URL", "http://localhost:8000")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions_file")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--out", help="write NDJSON here instead of stdout")
+    parser.add_argument("--num-results", type=int, default=4)
+    parser.add_argument("--persist", action="store_true", help="save each answer as a conversation")
+    args = parser.parse_args()
+
+    with open(args.questions_file, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        with httpx.stream(
+            "POST",
+            f"{args.api_url.rstrip('/')}/query/batch",
+            json={
+                "questions": questions,
+                "num_results": args.num_results,
+                "persist_conversations": args.persist,
+            },
+            timeout=None,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    out.write(line + "\n")
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
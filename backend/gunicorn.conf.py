@@ -0,0 +1,36 @@
+"""Multi-process serving: gunicorn forking uvicorn workers from a preloaded app.
+
+    gunicorn -c gunicorn.conf.py main:app    (or SERVER_WORKERS=4 python run.py)
+
+The app is imported once in the master and forked, so workers share its code
+pages. A LOCAL_INDEX_DIR index is opened in the master too. Its read-only
+mmaps are inherited by every worker and backed by one copy in the page cache,
+and each worker follows CURRENT to new versions on its own.
+
+Network clients are rebuilt per worker after the fork, with pool sizes from
+HTTP_MAX_CONNECTIONS, MONGO_MAX_POOL_SIZE and PINECONE_POOL_THREADS. Admission
+limits (RATE_LIMIT_*, MAX_CONCURRENT_COMPLETIONS) are per worker too.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("SERVER_WORKERS", os.cpu_count() or 1))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    from services import clients
+
+    # Map the local index once, before the workers are forked
+    clients.get_local_index()
+
+
+def post_fork(server, worker):
+    from services import clients
+
+    clients.reset_after_fork()
+    if os.environ.get("WARM_UP_ON_INIT", "false").lower() == "true":
+        clients.warm_up()
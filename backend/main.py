@@ -1,16 +1,22 @@
 import os
-from fastapi import FastAPI, HTTPException
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from mangum import Mangum
 import logging
 from dotenv import load_dotenv
 from services.query_service import QueryService, VideoReference, NoContextChunksFound
 from typing import List, Optional
 from pydantic import BaseModel
-from pinecone import Pinecone
-from openai import OpenAI
-from services.conversation_service import ConversationService
+from services import clients
+from services.conversation_service import ConversationService, ConversationVersion
+from services.admission_service import AdmissionService, RateLimited, Overloaded
+from services.transcript_service import TranscriptService, TranscriptNotFound
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 load_dotenv()
 
@@ -20,17 +26,23 @@ logger = logging.getLogger(__name__)
 
 
 # Environment variables
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-PINECONE_API_KEY = os.environ["PINECONE_API_KEY"]
-PINECONE_INDEX = os.environ["PINECONE_INDEX"]
-
-# Initialize clients
-client = OpenAI()
-index = Pinecone(api_key=PINECONE_API_KEY).Index(PINECONE_INDEX)
-
-# Initialize services
-query_service = QueryService(client, index)
+WARM_UP_ON_INIT = os.environ.get("WARM_UP_ON_INIT", "false").lower() == "true"
+MAX_BATCH_QUESTIONS = int(os.environ.get("MAX_BATCH_QUESTIONS", 1000))
+# Reverse proxies in front of the server (0 when API Gateway invokes Mangum)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1000))
+# Streamed responses the compressors would hold back until enough output builds up
+UNCOMPRESSED_PATHS = {"/query/batch"}
+
+# Initialize services (clients are created lazily on first use)
+query_service = QueryService()
 conversation_service = ConversationService()
+admission_service = AdmissionService()
+transcript_service = TranscriptService()
+
+# Open connections during the Lambda init phase instead of the first request
+if WARM_UP_ON_INIT:
+    clients.warm_up()
 
 
 # Initialize FastAPI
@@ -48,12 +60,41 @@ app.add_middleware(
 )
 
 
+class CompressionMiddleware:
+    """Brotli (if brotli-asgi is installed) or gzip for large responses, except streams."""
+
+    def __init__(self, app):
+        self.app = app
+        try:
+            from brotli_asgi import BrotliMiddleware
+
+            # Falls back to gzip for clients that don't accept br
+            self.compressed_app = BrotliMiddleware(app, quality=4, minimum_size=COMPRESSION_MIN_BYTES)
+        except ImportError:
+            self.compressed_app = GZipMiddleware(app, minimum_size=COMPRESSION_MIN_BYTES, compresslevel=6)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in UNCOMPRESSED_PATHS:
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+app.add_middleware(CompressionMiddleware)
+
+
 class QueryRequest(BaseModel):
     question: str
-    num_results: int = 4
+    num_results: int = 4  # upper bound; weak matches are dropped
     conversation_id: Optional[str] = None
 
 
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    num_results: int = 4
+    persist_conversations: bool = False
+
+
 class FollowUpQuestion(BaseModel):
     text: str
     category: str
@@ -67,36 +108,116 @@ class QueryResponse(BaseModel):
     follow_up_questions: List[FollowUpQuestion]
 
 
-class QueryError(Exception):
-    pass
+class TranscriptSegment(BaseModel):
+    start: float
+    end: float
+    text: str
+    timestamp_link: str
 
 
-@app.post("/query", response_model=QueryResponse)
-async def query_videos(request: QueryRequest):
-    try:
-        # Query and get answers for the conversation
-        answer, references, follow_up_questions = await query_service.query(
-            request.question, request.num_results
-        )
+class TranscriptPage(BaseModel):
+    video_id: str
+    video_title: str
+    video_url: str
+    segments: List[TranscriptSegment]
+    next_cursor: Optional[int]  # pass as `cursor` (with the same from/to) for the next page
 
-        # Save both user and assistant messages in the conversation
-        user_message = {"type": "user", "content": request.question}
 
-        assistant_message = {
-            "type": "assistant",
-            "content": answer,
-            "references": [ref.dict() for ref in references],
-            "follow_up_questions": follow_up_questions,
-        }
+class QueryError(Exception):
+    pass
 
-        # Save user message
-        conversation_id = await conversation_service.create_or_update_conversation(
-            request.conversation_id, user_message
-        )
 
-        # Save assistant message
-        await conversation_service.create_or_update_conversation(
-            conversation_id, assistant_message
+def get_client_id(http_request: Request) -> Optional[str]:
+    """Identify the caller by an address our own infrastructure observed.
+
+    Under Mangum the peer address is the source IP API Gateway saw. Clients can
+    put anything in X-Forwarded-For, so it is only read behind TRUSTED_PROXY_HOPS
+    proxies of our own, each of which appends the address it received from.
+    """
+    if TRUSTED_PROXY_HOPS:
+        forwarded_for = [
+            address.strip()
+            for address in http_request.headers.get("x-forwarded-for", "").split(",")
+            if address.strip()
+        ]
+        if len(forwarded_for) >= TRUSTED_PROXY_HOPS:
+            return forwarded_for[-TRUSTED_PROXY_HOPS]
+    return http_request.client.host if http_request.client else None
+
+
+def conversation_headers(version: ConversationVersion) -> dict:
+    # Browsers may keep a copy but must revalidate it, which is a cheap 304
+    return {
+        "ETag": version.etag,
+        "Last-Modified": format_datetime(version.last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+
+
+def not_modified(http_request: Request, version: ConversationVersion) -> bool:
+    """Whether the client's cached copy is still current (If-None-Match wins if sent)."""
+    if_none_match = http_request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return version.etag in [tag.strip() for tag in if_none_match.split(",")]
+
+    if_modified_since = http_request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            # HTTP dates have whole-second precision
+            return version.last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def save_exchange(
+    conversation_id: Optional[str],
+    question: str,
+    answer: str,
+    references: List[VideoReference],
+    follow_up_questions: List[dict],
+) -> str:
+    """Save both user and assistant messages in the conversation."""
+    user_message = {"type": "user", "content": question}
+
+    assistant_message = {
+        "type": "assistant",
+        "content": answer,
+        "references": [ref.dict() for ref in references],
+        "follow_up_questions": follow_up_questions,
+    }
+
+    # Save user message
+    conversation_id = await conversation_service.create_or_update_conversation(
+        conversation_id, user_message
+    )
+
+    # Save assistant message
+    await conversation_service.create_or_update_conversation(
+        conversation_id, assistant_message
+    )
+
+    return conversation_id
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query_videos(request: QueryRequest, http_request: Request):
+    try:
+        await admission_service.check_rate_limit(get_client_id(http_request))
+
+        # Cached and in-flight answers cost no completion, so they skip the queue
+        if query_service.is_answer_available(request.question, request.num_results):
+            answer, references, follow_up_questions = await query_service.query(
+                request.question, request.num_results
+            )
+        else:
+            async with admission_service.completion_slot():
+                answer, references, follow_up_questions = await query_service.query(
+                    request.question, request.num_results
+                )
+
+        conversation_id = await save_exchange(
+            request.conversation_id, request.question, answer, references, follow_up_questions
         )
 
         return QueryResponse(
@@ -110,22 +231,148 @@ async def query_videos(request: QueryRequest):
             status_code=404,
             detail="No relevant video segments found for this question",
         )
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
+        # Imported here so openai stays off the cold-start path
+        from openai import RateLimitError
+
+        if isinstance(e, RateLimitError):
+            logger.warning(f"OpenAI rate limit reached: {str(e)}")
+            raise HTTPException(
+                status_code=503,
+                detail="The service is busy, please try again shortly",
+                headers={"Retry-After": "10"},
+            )
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/batch")
+async def query_videos_batch(request: BatchQueryRequest, http_request: Request):
+    """Answer many questions, streaming one NDJSON line per question as it finishes."""
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch",
+        )
+    client_id = get_client_id(http_request)
+    try:
+        await admission_service.check_rate_limit(client_id)
+        release_batch = admission_service.start_batch(client_id)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    # Embed before streaming starts, so a failure is still an error status
+    try:
+        embeddings = await query_service.embed_batch(request.questions)
+    except Exception as e:
+        release_batch()
+        from openai import RateLimitError
+
+        if isinstance(e, RateLimitError):
+            logger.warning(f"OpenAI rate limit reached: {str(e)}")
+            raise HTTPException(
+                status_code=503,
+                detail="The service is busy, please try again shortly",
+                headers={"Retry-After": "10"},
+            )
+        logger.error(f"Error embedding batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream_results():
+        results = query_service.query_batch(
+            request.questions, embeddings, request.num_results, admission_service.batch_slots
+        )
+        try:
+            async for position, result, error in results:
+                line = {"index": position, "question": request.questions[position]}
+
+                if isinstance(error, NoContextChunksFound):
+                    line["error"] = "No relevant video segments found for this question"
+                elif error is not None:
+                    logger.error(f"Error processing batch query: {str(error)}")
+                    line["error"] = str(error)
+                else:
+                    answer, references, follow_up_questions = result
+                    if request.persist_conversations:
+                        line["conversation_id"] = await save_exchange(
+                            None, line["question"], answer, references, follow_up_questions
+                        )
+                    line["answer"] = answer
+                    line["references"] = [ref.dict() for ref in references]
+                    line["follow_up_questions"] = follow_up_questions
+
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            await results.aclose()
+            release_batch()
+
+    # The background task also releases the batch if the stream never started
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(release_batch),
+    )
+
+
 @app.get("/conversations")
 async def get_conversations():
     return await conversation_service.get_conversations()
 
 
 @app.get("/conversations/{conversation_id}")
-async def get_conversation(conversation_id: str):
-    conversation = await conversation_service.get_conversation(conversation_id)
-    if not conversation:
+async def get_conversation(conversation_id: str, http_request: Request):
+    version = await conversation_service.get_conversation_version(conversation_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if not_modified(http_request, version):
+        return Response(status_code=304, headers=conversation_headers(version))
+
+    cached = await conversation_service.get_conversation_payload(conversation_id, version)
+    if not cached:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return conversation
+    version, payload = cached
+    return Response(payload, media_type="application/json", headers=conversation_headers(version))
+
+
+@app.get("/videos/{video_id}/transcript", response_model=TranscriptPage)
+async def get_transcript(
+    video_id: str,
+    http_request: Request,
+    response: Response,
+    start: float = Query(0, alias="from", ge=0),
+    end: Optional[float] = Query(None, alias="to", ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[int] = Query(None, ge=0),
+):
+    try:
+        etag = transcript_service.get_etag(video_id, start, end, limit, cursor)
+        # Transcripts only change when re-transcribed, so pages cache well
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+        if http_request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        page = transcript_service.get_transcript_page(video_id, start, end, limit, cursor)
+        response.headers.update(headers)
+        return page
+    except TranscriptNotFound:
+        raise HTTPException(status_code=404, detail="Transcript not found")
 
 
 @app.get("/health")
@@ -133,4 +380,12 @@ async def health_check():
     return {"status": "healthy"}
 
 
-handler = Mangum(app)
+mangum_handler = Mangum(app)
+
+
+def handler(event, context):
+    """AWS Lambda handler. Scheduled `{"warmup": true}` events only open connections."""
+    if isinstance(event, dict) and event.get("warmup"):
+        clients.warm_up()
+        return {"statusCode": 200, "body": "warm"}
+    return mangum_handler(event, context)
@@ -0,0 +1,72 @@
+"""Profile the import time of the API module, to track Lambda cold starts.
+
+Usage:
+    python profile_startup.py [--module main] [--top 20] [--json] [--max-ms 1500]
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+reports the slowest modules by cumulative import time. With --max-ms the
+script exits non-zero when the total exceeds the budget, so it can gate CI.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, List
+
+
+def profile_imports(module: str) -> List[Dict]:
+    """Import `module` in a fresh interpreter and return per-module timings."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        # Format: "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print JSON for tracking")
+    parser.add_argument("--max-ms", type=float, help="fail if total import time exceeds this")
+    args = parser.parse_args()
+
+    timings = profile_imports(args.module)
+    total_ms = sum(t["cumulative_ms"] for t in timings if t["depth"] == 0)
+    slowest = sorted(timings, key=lambda t: t["cumulative_ms"], reverse=True)[: args.top]
+
+    if args.json:
+        print(json.dumps({"module": args.module, "total_ms": round(total_ms, 1), "modules": slowest}, indent=2))
+    else:
+        print(f"Total import time for {args.module}: {total_ms:.1f} ms\n")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for t in slowest:
+            print(f"{t['cumulative_ms']:>14.1f} {t['self_ms']:>9.1f}  {t['module']}")
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"Import time {total_ms:.1f} ms exceeds budget of {args.max_ms:.1f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
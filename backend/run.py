@@ -1,7 +1,22 @@
-from main import app
-import uvicorn
+import os
+
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 1))
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 
 if __name__ == "__main__":
+    if SERVER_WORKERS > 1:
+        # One process per core, forked from a preloaded app (see gunicorn.conf.py)
+        os.execvp(
+            "gunicorn",
+            [
+                "gunicorn",
+                "--chdir", BACKEND_DIR,
+                "--config", os.path.join(BACKEND_DIR, "gunicorn.conf.py"),
+                "main:app",
+            ],
+        )
+
     import uvicorn
+    from main import app
 
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,211 @@
+from typing import Callable, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from services import clients
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", 20))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 5))
+MAX_CONCURRENT_COMPLETIONS = int(os.environ.get("MAX_CONCURRENT_COMPLETIONS", 8))
+MAX_QUEUED_COMPLETIONS = int(os.environ.get("MAX_QUEUED_COMPLETIONS", 32))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("QUEUE_TIMEOUT_SECONDS", 10))
+# Completions shared by all batch requests, on top of MAX_CONCURRENT_COMPLETIONS
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+MAX_BATCHES_PER_CLIENT = int(os.environ.get("MAX_BATCHES_PER_CLIENT", 1))
+MAX_TRACKED_CLIENTS = 10000
+# "memory" limits clients per process; "mongo" shares the limit between every
+# Lambda container and gunicorn worker
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_WINDOW_SECONDS = 60
+
+
+class RateLimited(Exception):
+    """The client has used up its request budget."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = math.ceil(retry_after)
+
+
+class Overloaded(Exception):
+    """The completion queue is full, or the wait for a slot timed out."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Server busy, retry after {retry_after:.1f}s")
+        self.retry_after = math.ceil(retry_after)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class MongoRateLimiter:
+    """Per-client request counts per minute, shared through MongoDB.
+
+    Each client gets one counter document per fixed window, removed by a TTL index
+    once the window is over.
+    """
+
+    def __init__(self, limit: float, window: int = RATE_LIMIT_WINDOW_SECONDS):
+        self.limit = limit
+        self.window = window
+        self._indexed = False
+
+    @property
+    def collection(self):
+        return clients.get_mongo_db().rate_limits
+
+    def take(self, client_id: str) -> float:
+        """Count a request. Returns 0 if allowed, else seconds until the next window."""
+        from pymongo import ReturnDocument
+
+        if not self._indexed:
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+        now = time.time()
+        window_start = int(now // self.window) * self.window
+        window_end = datetime.fromtimestamp(window_start + self.window, timezone.utc)
+        counter = self.collection.find_one_and_update(
+            {"_id": f"{client_id}:{window_start}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {"expires_at": window_end + timedelta(seconds=self.window)},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if counter["count"] <= self.limit:
+            return 0
+        return window_start + self.window - now
+
+
+class AdmissionService:
+    """Per-client rate limits plus caps on concurrent completions.
+
+    Interactive queries wait in a bounded queue for `slots`. Batch questions
+    share `batch_slots` across every batch, and wait for them as long as needed.
+
+    The completion and batch caps hold per process: per Lambda container, or per
+    gunicorn worker. Only the rate limit can be shared, with RATE_LIMIT_STORE=mongo.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        max_concurrent: int = MAX_CONCURRENT_COMPLETIONS,
+        max_queued: int = MAX_QUEUED_COMPLETIONS,
+        queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+        batch_concurrency: int = BATCH_CONCURRENCY,
+        max_batches_per_client: int = MAX_BATCHES_PER_CLIENT,
+    ):
+        self.rate = rate_per_minute / 60
+        self.shared_limiter = (
+            MongoRateLimiter(rate_per_minute) if RATE_LIMIT_STORE == "mongo" else None
+        )
+        self.burst = burst
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.queued = 0
+        self.batch_slots = asyncio.Semaphore(batch_concurrency)
+        self.max_batches_per_client = max_batches_per_client
+        self.active_batches: dict = {}
+
+    async def check_rate_limit(self, client_id: Optional[str]):
+        """Raise RateLimited when the client has no tokens left."""
+        client_id = client_id or "anonymous"
+
+        if self.shared_limiter is not None:
+            try:
+                retry_after = await asyncio.to_thread(self.shared_limiter.take, client_id)
+            except Exception as e:
+                # Don't turn a database hiccup into an outage; fall back to this process
+                logger.warning(f"Shared rate limit unavailable, limiting locally: {str(e)}")
+            else:
+                if retry_after:
+                    raise RateLimited(retry_after)
+                return
+
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = self.buckets[client_id] = TokenBucket(self.rate, self.burst)
+            # Forget the least recently seen clients to bound memory
+            if len(self.buckets) > MAX_TRACKED_CLIENTS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client_id)
+
+        retry_after = bucket.take()
+        if retry_after:
+            raise RateLimited(retry_after)
+
+    @asynccontextmanager
+    async def completion_slot(self):
+        """Hold one of the completion slots, waiting in a bounded queue if needed."""
+        if self.slots.locked() and self.queued >= self.max_queued:
+            logger.warning(f"Completion queue full ({self.queued} waiting), shedding request")
+            raise Overloaded(self.queue_timeout)
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(self.queue_timeout)
+        finally:
+            self.queued -= 1
+
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def start_batch(self, client_id: Optional[str]) -> Callable[[], None]:
+        """Admit a batch for the client, returning an idempotent release function.
+
+        Raises RateLimited when the client already has its maximum running.
+        """
+        client_id = client_id or "anonymous"
+        if self.active_batches.get(client_id, 0) >= self.max_batches_per_client:
+            raise RateLimited(60)
+        self.active_batches[client_id] = self.active_batches.get(client_id, 0) + 1
+
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.active_batches[client_id] -= 1
+            if not self.active_batches[client_id]:
+                del self.active_batches[client_id]
+
+        return release
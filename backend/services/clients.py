@@ -0,0 +1,111 @@
+import os
+import logging
+from functools import lru_cache
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables (pool sizes are per process: with SERVER_WORKERS
+# workers, each one opens up to this many connections)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 32))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 20))
+PINECONE_POOL_THREADS = int(os.environ.get("PINECONE_POOL_THREADS", 8))
+
+
+# Clients are built on first use and cached for the life of the process, so a
+# warm Lambda container (or uvicorn worker) reuses the same connections. The
+# SDK imports live inside the getters to keep them off the cold-start path.
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """Return the shared OpenAI client."""
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+
+    return OpenAI(
+        api_key=os.environ["OPENAI_API_KEY"],
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            )
+        ),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_pinecone_client():
+    """Return the shared Pinecone client."""
+    from pinecone import Pinecone
+
+    return Pinecone(api_key=os.environ["PINECONE_API_KEY"], pool_threads=PINECONE_POOL_THREADS)
+
+
+@lru_cache(maxsize=None)
+def get_pinecone_index(index_name: Optional[str] = None):
+    """Return the shared handle for an index, PINECONE_INDEX by default."""
+    return get_pinecone_client().Index(
+        index_name or os.environ["PINECONE_INDEX"], pool_threads=PINECONE_POOL_THREADS
+    )
+
+
+@lru_cache(maxsize=None)
+def get_mongo_client():
+    """Return the shared MongoDB client."""
+    from pymongo import MongoClient
+
+    return MongoClient(os.getenv("MONGODB_URI"), maxPoolSize=MONGO_MAX_POOL_SIZE)
+
+
+@lru_cache(maxsize=None)
+def get_local_index():
+    """Return the in-process quantized index, or None unless LOCAL_INDEX_DIR is set.
+
+    LOCAL_INDEX_DIR is either an index directory, or a directory of versions
+    with a CURRENT pointer that is followed as it changes.
+    """
+    index_dir = os.environ.get("LOCAL_INDEX_DIR")
+    if not index_dir:
+        return None
+    from services.vector_index import CURRENT_POINTER, QuantizedIndex, VersionedIndex
+
+    if os.path.exists(os.path.join(index_dir, CURRENT_POINTER)):
+        return VersionedIndex(index_dir)
+    return QuantizedIndex(index_dir)
+
+
+def get_mongo_db():
+    """Return the configured MongoDB database."""
+    return get_mongo_client()[os.getenv("MONGODB_DB")]
+
+
+def reset_after_fork():
+    """Drop network clients inherited from a preloading parent process.
+
+    Their sockets and background threads don't survive a fork, so each worker
+    builds its own on first use. The local index is kept: its read-only mmaps
+    are shared with the parent through the page cache.
+    """
+    for getter in (get_openai_client, get_pinecone_client, get_pinecone_index, get_mongo_client):
+        getter.cache_clear()
+
+
+def warm_up():
+    """Pre-open every client connection so the next request doesn't pay for it."""
+    checks = {
+        "mongodb": lambda: get_mongo_client().admin.command("ping"),
+        "pinecone": lambda: get_pinecone_index().describe_index_stats(),
+        "openai": lambda: get_openai_client().models.list(),
+    }
+    for name, check in checks.items():
+        try:
+            check()
+            logger.info(f"Warmed up {name} connection")
+        except Exception as e:
+            logger.error(f"Error warming up {name} connection: {str(e)}")
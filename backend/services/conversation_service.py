@@ -1,17 +1,48 @@
-from typing import List, Optional
+from typing import List, NamedTuple, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime, timezone
 from uuid import uuid4
-from pymongo import MongoClient, DESCENDING
+import hashlib
+import json
 import os
-from dotenv import load_dotenv
+from services import clients
+
+# pymongo.DESCENDING, inlined so pymongo is only imported on first use
+DESCENDING = -1
+
+# Environment variables
+CONVERSATION_CACHE_SIZE = int(os.environ.get("CONVERSATION_CACHE_SIZE", 128))
+
+
+class ConversationVersion(NamedTuple):
+    updated_at: datetime
+    message_count: int
+
+    @property
+    def etag(self) -> str:
+        key = f"{self.updated_at.isoformat()}:{self.message_count}"
+        return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    @property
+    def last_modified(self) -> datetime:
+        # MongoDB returns naive datetimes in UTC
+        return self.updated_at.replace(tzinfo=timezone.utc)
+
+
+def serialize_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
 
-load_dotenv()
 
 class ConversationService:
     def __init__(self):
-        self.client = MongoClient(os.getenv("MONGODB_URI"))
-        self.db = self.client[os.getenv("MONGODB_DB")]
-        self.conversations = self.db.conversations
+        # Serialized conversations keyed by conversation_id, as (version, JSON bytes)
+        self.payloads: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @property
+    def conversations(self):
+        return clients.get_mongo_db().conversations
 
     async def create_or_update_conversation(
         self, conversation_id: Optional[str], message: dict
@@ -36,6 +67,7 @@ class ConversationService:
             self.conversations.insert_one(conversation)
         else:
             # Update existing conversation
+            self.payloads.pop(conversation_id, None)
             self.conversations.update_one(
                 {"conversation_id": conversation_id},
                 {
@@ -72,3 +104,44 @@ class ConversationService:
             {"conversation_id": conversation_id},
             {"_id": 0}
         )
+
+    async def get_conversation_version(self, conversation_id: str) -> Optional[ConversationVersion]:
+        """Read just enough of a conversation to tell whether it changed."""
+        document = self.conversations.find_one(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "updated_at": 1, "message_count": {"$size": "$messages"}},
+        )
+        if not document:
+            return None
+        return ConversationVersion(document["updated_at"], document["message_count"])
+
+    async def get_conversation_payload(
+        self, conversation_id: str, version: ConversationVersion
+    ) -> Optional[Tuple[ConversationVersion, bytes]]:
+        """The conversation as JSON, serialized once per version, with the version it is.
+
+        Each process caches its own copies; checking them against `version`
+        keeps them correct when another process appended to the conversation.
+        """
+        cached = self.payloads.get(conversation_id)
+        if cached and cached[0] == version:
+            self.payloads.move_to_end(conversation_id)
+            return cached
+
+        conversation = await self.get_conversation(conversation_id)
+        if not conversation:
+            return None
+        payload = json.dumps(
+            conversation, default=serialize_value, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+        # Keyed by the version actually serialized, which a racing write may have moved past
+        cached = (
+            ConversationVersion(conversation["updated_at"], len(conversation["messages"])),
+            payload,
+        )
+        self.payloads[conversation_id] = cached
+        self.payloads.move_to_end(conversation_id)
+        while len(self.payloads) > CONVERSATION_CACHE_SIZE:
+            self.payloads.popitem(last=False)
+        return cached
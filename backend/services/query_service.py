@@ -1,12 +1,42 @@
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import nullcontext
 from pydantic import BaseModel
+import asyncio
 import logging
 import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+from services import clients
+from services.summary_service import SummaryService
+from services.routing_service import (
+    DEFAULT_EMBEDDING_MODEL,
+    MIN_RELEVANCE_SCORE,
+    SCORE_GAP_ELBOW,
+    RoutingService,
+    SearchTarget,
+    search_settings,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Retrieval tuning: over-fetch candidates, drop weak ones, cut at the score elbow
+# (the cutoffs depend on the embedding model, see services.routing_service)
+RETRIEVAL_OVERFETCH = int(os.environ.get("RETRIEVAL_OVERFETCH", 3))
+RETRIEVAL_MAX_CANDIDATES = int(os.environ.get("RETRIEVAL_MAX_CANDIDATES", 30))
+RERANK_CANDIDATES = os.environ.get("RERANK_CANDIDATES", "false").lower() == "true"
+RERANK_LEXICAL_WEIGHT = float(os.environ.get("RERANK_LEXICAL_WEIGHT", 0.1))
+
+# Recently computed answers, reused for repeated questions
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 300))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 256))
+
+EMBEDDING_BATCH_SIZE = 2048  # most inputs the embeddings API takes per request
+
 
 # no context chunks found Exception
 class NoContextChunksFound(Exception):
@@ -21,9 +51,34 @@ class VideoReference(BaseModel):
 
 
 class QueryService:
-    def __init__(self, client, index):
-        self.client = client
-        self.index = index
+    def __init__(self, client=None, index=None, summary_service=None, routing_service=None):
+        # Clients default to the shared lazily-built ones (see services.clients)
+        self._client = client
+        self._index = index
+        self.summary_service = summary_service or SummaryService()
+        self.routing_service = routing_service or RoutingService()
+        # Shadow comparisons run after the response; keep references until done
+        self._background_tasks = set()
+        # In-flight answers keyed by (normalized question, num_results). Like the
+        # answer cache, these are per process, so coalescing is per worker or container.
+        self._in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        # Completed answers keyed the same way, as (completed_at, result)
+        self._answers: OrderedDict[Tuple[str, int], Tuple[float, tuple]] = OrderedDict()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = clients.get_openai_client()
+        return self._client
+
+    def search_targets(self, allow_ab: bool = True) -> Tuple[SearchTarget, Optional[SearchTarget]]:
+        """Return (target to serve from, target to shadow-compare against or None)."""
+        # An explicitly passed or in-process index bypasses index routing. A local
+        # index carries the settings of the routed index it was exported from.
+        index = self._index or clients.get_local_index()
+        if index is not None:
+            return SearchTarget("local", index, *search_settings(getattr(index, "meta", None))), None
+        return self.routing_service.choose_targets(allow_ab)
 
     def create_messages(self, question: str, context_chunks: List[Dict]) -> List[Dict]:
         """Create messages for OpenAI chat completion."""
@@ -85,29 +140,285 @@ class QueryService:
 
         return messages
 
-    async def query_pinecone(self, question: str, num_results: int = 4) -> List[Dict]:
-        """Query Pinecone for relevant video segments."""
+    @staticmethod
+    def keywords(text: str) -> set:
+        """Lowercased content words of a text, for cheap lexical re-ranking."""
+        return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 3}
 
-        # Get embeddings for the question
-        response = self.client.embeddings.create(
-            model="text-embedding-ada-002", input=question
+    def select_matches(
+        self,
+        question: str,
+        matches: List,
+        num_results: int,
+        min_score: float = MIN_RELEVANCE_SCORE,
+        score_gap: float = SCORE_GAP_ELBOW,
+    ) -> List:
+        """Keep relevant matches, optionally re-ranked, up to the score-gap elbow."""
+        candidates = [
+            (match.score, match)
+            for match in matches
+            if match.score >= min_score
+        ]
+
+        if RERANK_CANDIDATES and candidates:
+            # Boost candidates sharing the question's keywords
+            question_words = self.keywords(question)
+            if question_words:
+                candidates = [
+                    (
+                        score
+                        + RERANK_LEXICAL_WEIGHT
+                        * len(question_words & self.keywords(match.metadata["text"]))
+                        / len(question_words),
+                        match,
+                    )
+                    for score, match in candidates
+                ]
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        # Stop at the first large drop in score: everything after it is a weaker cluster
+        selected = []
+        for score, match in candidates[:num_results]:
+            if selected and selected[-1][0] - score > score_gap:
+                break
+            selected.append((score, match))
+
+        return [match for _, match in selected]
+
+    async def embed_questions(
+        self, questions: List[str], model: str = DEFAULT_EMBEDDING_MODEL
+    ) -> List[List[float]]:
+        """Embed many questions with as few embeddings requests as possible."""
+        embeddings = []
+        for batch_start in range(0, len(questions), EMBEDDING_BATCH_SIZE):
+            response = await asyncio.to_thread(
+                self.client.embeddings.create,
+                model=model,
+                input=questions[batch_start : batch_start + EMBEDDING_BATCH_SIZE],
+            )
+            embeddings.extend(item.embedding for item in response.data)
+        return embeddings
+
+    async def search(
+        self,
+        target: SearchTarget,
+        question: str,
+        query_embedding: List[float],
+        num_results: int,
+        metadata_filter: Optional[Dict] = None,
+    ) -> List:
+        """Query one index and keep the relevant matches."""
+        query_response = await asyncio.to_thread(
+            target.index.query,
+            vector=query_embedding,
+            top_k=max(
+                num_results,
+                min(num_results * RETRIEVAL_OVERFETCH, RETRIEVAL_MAX_CANDIDATES),
+            ),
+            include_metadata=True,
+            filter=metadata_filter,
+        )
+        return self.select_matches(
+            question,
+            query_response.matches,
+            num_results,
+            target.min_relevance_score,
+            target.score_gap_elbow,
         )
-        query_embedding = response.data[0].embedding
 
-        # Query Pinecone
-        query_response = self.index.query(
-            vector=query_embedding, top_k=num_results, include_metadata=True
+    async def query_pinecone(
+        self,
+        question: str,
+        num_results: int = 4,
+        query_embedding: Optional[List[float]] = None,
+        video_ids: Optional[List[str]] = None,
+    ) -> List[Dict]:
+        """Query Pinecone for relevant video segments, optionally only from some videos."""
+        metadata_filter = {"video_id": {"$in": video_ids}} if video_ids else None
+        # A precomputed embedding was made with the active index's model, so no A/B
+        target, shadow = await asyncio.to_thread(
+            self.search_targets, allow_ab=query_embedding is None
         )
+        started = time.monotonic()
+
+        # Get embeddings for the question
+        if query_embedding is None:
+            query_embedding = (await self.embed_questions([question], target.embedding_model))[0]
+
+        matches = await self.search(target, question, query_embedding, num_results, metadata_filter)
+
+        if shadow is not None:
+            task = asyncio.ensure_future(
+                self.compare_shadow(
+                    question,
+                    num_results,
+                    target,
+                    matches,
+                    time.monotonic() - started,
+                    shadow,
+                    metadata_filter,
+                )
+            )
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+        if not matches:
+            raise NoContextChunksFound
+
+        return [match.metadata for match in matches]
+
+    @staticmethod
+    def overlap(expected: List, actual: List) -> float:
+        """Share of expected matches that some actual match covers (same video, overlapping time).
+
+        Indexes built with different chunkings have different ids, so ids can't be compared.
+        """
+        if not expected:
+            return 1.0
+        covered = 0
+        for match in expected:
+            if any(
+                other.metadata["video_id"] == match.metadata["video_id"]
+                and other.metadata["start"] < match.metadata["end"]
+                and match.metadata["start"] < other.metadata["end"]
+                for other in actual
+            ):
+                covered += 1
+        return covered / len(expected)
+
+    async def compare_shadow(
+        self,
+        question: str,
+        num_results: int,
+        target: SearchTarget,
+        matches: List,
+        latency: float,
+        shadow: SearchTarget,
+        metadata_filter: Optional[Dict] = None,
+    ):
+        """Run the same query on the shadow index and record latency and agreement."""
+        try:
+            started = time.monotonic()
+            shadow_embedding = (await self.embed_questions([question], shadow.embedding_model))[0]
+            shadow_matches = await self.search(
+                shadow, question, shadow_embedding, num_results, metadata_filter
+            )
+            shadow_latency = time.monotonic() - started
+
+            comparison = {
+                "question": question,
+                "served": {"index": target.name, "latency_ms": latency * 1000, "hits": len(matches)},
+                "shadow": {"index": shadow.name, "latency_ms": shadow_latency * 1000, "hits": len(shadow_matches)},
+                "overlap": self.overlap(matches, shadow_matches),
+                "created_at": datetime.now(timezone.utc),
+            }
+            logger.info(
+                f"Shadow comparison {target.name} vs {shadow.name}: "
+                f"{latency * 1000:.0f}ms vs {shadow_latency * 1000:.0f}ms, overlap {comparison['overlap']:.2f}"
+            )
+            await asyncio.to_thread(clients.get_mongo_db().index_comparisons.insert_one, comparison)
+        except Exception as e:
+            logger.error(f"Error comparing against shadow index {shadow.name}: {str(e)}")
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Normalize a question so trivially different phrasings share a key."""
+        return " ".join(question.lower().split()).rstrip("?.! ")
 
-        # Extract and format results
-        results = []
-        for match in query_response.matches:
-            results.append(match.metadata)
+    def cached_answer(self, key: Tuple[str, int]):
+        """Return a still-fresh answer for the key, if any."""
+        cached = self._answers.get(key)
+        if cached is None:
+            return None
+        completed_at, result = cached
+        if time.monotonic() - completed_at > ANSWER_CACHE_TTL:
+            del self._answers[key]
+            return None
+        return result
 
-        return results
+    def is_answer_available(self, question: str, num_results: int) -> bool:
+        """Whether the question can be answered without a new completion."""
+        key = (self.normalize_question(question), num_results)
+        return key in self._in_flight or self.cached_answer(key) is not None
+
+    def on_answer_done(self, key: Tuple[str, int], in_flight: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if in_flight.cancelled() or in_flight.exception() is not None:
+            return
+        self._answers[key] = (time.monotonic(), in_flight.result())
+        self._answers.move_to_end(key)
+        if len(self._answers) > ANSWER_CACHE_SIZE:
+            self._answers.popitem(last=False)
 
     async def query(self, question: str, num_results: int):
-        context_chunks = await self.query_pinecone(question, num_results)
+        """Answer a question, sharing one computation between identical concurrent calls."""
+        key = (self.normalize_question(question), num_results)
+
+        result = self.cached_answer(key)
+        if result is not None:
+            logger.info(f"Serving cached answer: {key[0]}")
+        else:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = asyncio.ensure_future(self.answer(question, num_results))
+                self._in_flight[key] = in_flight
+                in_flight.add_done_callback(lambda done: self.on_answer_done(key, done))
+            else:
+                logger.info(f"Joining in-flight query: {key[0]}")
+
+            # Shield so one caller disconnecting doesn't cancel the others' answer
+            result = await asyncio.shield(in_flight)
+
+        answer, references, follow_up_questions = result
+        return answer, list(references), list(follow_up_questions)
+
+    def sitting_context_chunks(self, sittings: List[dict]) -> List[Dict]:
+        """Precomputed window summaries of sittings, shaped like retrieved chunks."""
+        return [
+            {
+                "text": window["summary"],
+                "timestamp": window["timestamp"],
+                "timestamp_link": window["timestamp_link"],
+                "video_title": sitting["video_title"],
+            }
+            for sitting in sittings
+            for window in sitting["window_summaries"]
+        ]
+
+    async def answer(
+        self,
+        question: str,
+        num_results: int,
+        query_embedding: Optional[List[float]] = None,
+        completion_slots: Optional[asyncio.Semaphore] = None,
+    ):
+        """Retrieve context and run the completion for a single question."""
+        # Questions about a specific sitting draw on its precomputed summaries
+        sittings = await asyncio.to_thread(self.summary_service.find_sittings, question)
+
+        if len(sittings) == 1 and self.summary_service.is_overview_question(question):
+            logger.info(f"Serving precomputed summary of {sittings[0]['video_title']}")
+            context_chunks = self.sitting_context_chunks(sittings)
+            return (
+                sittings[0]["summary"],
+                self.format_references(context_chunks),
+                sittings[0]["follow_up_questions"],
+            )
+
+        if sittings:
+            # Verbatim excerpts from those sittings, framed by their summaries
+            try:
+                context_chunks = await self.query_pinecone(
+                    question,
+                    num_results,
+                    query_embedding,
+                    video_ids=[sitting["video_id"] for sitting in sittings],
+                )
+            except NoContextChunksFound:
+                context_chunks = []
+            context_chunks += self.sitting_context_chunks(sittings)
+        else:
+            context_chunks = await self.query_pinecone(question, num_results, query_embedding)
 
         if not context_chunks:
             raise NoContextChunksFound
@@ -116,12 +427,14 @@ class QueryService:
         messages = self.create_messages(question, context_chunks)
 
         # Get response from GPT-4
-        completion = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0,
-            max_tokens=1000,
-        )
+        async with completion_slots or nullcontext():
+            completion = await asyncio.to_thread(
+                self.client.chat.completions.create,
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0,
+                max_tokens=1000,
+            )
 
         full_response = completion.choices[0].message.content
         parts = full_response.split("FOLLOW_UP_QUESTIONS:")
@@ -137,8 +450,11 @@ class QueryService:
                 logger.error("Failed to parse follow-up questions JSON")
                 follow_up_questions = []
 
-        # Format video references
-        references = [
+        return answer, self.format_references(context_chunks), follow_up_questions
+
+    def format_references(self, context_chunks: List[Dict]) -> List[VideoReference]:
+        """Format video references."""
+        return [
             VideoReference(
                 video_url=chunk["timestamp_link"],
                 timestamp=chunk["timestamp"],
@@ -148,4 +464,39 @@ class QueryService:
             for chunk in context_chunks
         ]
 
-        return answer, references, follow_up_questions
+    async def embed_batch(self, questions: List[str]) -> List[List[float]]:
+        """Embed a batch's questions up front, in as few requests as possible."""
+        target, _ = await asyncio.to_thread(self.search_targets, allow_ab=False)
+        return await self.embed_questions(questions, target.embedding_model)
+
+    async def query_batch(
+        self,
+        questions: List[str],
+        embeddings: List[List[float]],
+        num_results: int,
+        completion_slots: asyncio.Semaphore,
+    ) -> AsyncIterator[Tuple[int, Optional[tuple], Optional[Exception]]]:
+        """Answer many questions, yielding (position, result, error) as each finishes.
+
+        Questions come with their embeddings (see embed_batch). Retrieval runs
+        concurrently, and completions wait for one of `completion_slots`.
+        """
+
+        async def answer_one(position: int, question: str, embedding: List[float]):
+            try:
+                result = await self.answer(question, num_results, embedding, completion_slots)
+                return position, result, None
+            except Exception as e:
+                return position, None, e
+
+        pending = [
+            asyncio.ensure_future(answer_one(position, question, embedding))
+            for position, (question, embedding) in enumerate(zip(questions, embeddings))
+        ]
+        try:
+            for finished in asyncio.as_completed(pending):
+                yield await finished
+        finally:
+            # The client went away mid-stream: stop paying for the rest
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,99 @@
+from typing import Any, NamedTuple, Optional, Tuple
+import logging
+import os
+import random
+import time
+from services import clients
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+ROUTING_CACHE_TTL = float(os.environ.get("ROUTING_CACHE_TTL", 30))
+# Relevance cutoffs for DEFAULT_EMBEDDING_MODEL. Scores aren't comparable across
+# models, so indexes built with other models carry their own in the routing
+MIN_RELEVANCE_SCORE = float(os.environ.get("MIN_RELEVANCE_SCORE", 0.75))
+SCORE_GAP_ELBOW = float(os.environ.get("SCORE_GAP_ELBOW", 0.04))
+
+
+class SearchTarget(NamedTuple):
+    name: str
+    index: Any
+    embedding_model: str
+    min_relevance_score: float = MIN_RELEVANCE_SCORE
+    score_gap_elbow: float = SCORE_GAP_ELBOW
+
+
+def search_settings(config: Optional[dict]) -> Tuple[str, float, float]:
+    """(embedding_model, min_relevance_score, score_gap_elbow) for a routing entry."""
+    config = config or {}
+    embedding_model = config.get("embedding_model") or DEFAULT_EMBEDDING_MODEL
+    if embedding_model == DEFAULT_EMBEDDING_MODEL:
+        min_score, score_gap = MIN_RELEVANCE_SCORE, SCORE_GAP_ELBOW
+    else:
+        # Without a tuned cutoff for this model, rely on the score-gap elbow alone
+        min_score, score_gap = 0.0, SCORE_GAP_ELBOW
+    return (
+        embedding_model,
+        config.get("min_relevance_score", min_score),
+        config.get("score_gap_elbow", score_gap),
+    )
+
+
+class RoutingService:
+    """Which vector index serves queries, and which one (if any) is being evaluated.
+
+    The routing lives in a single MongoDB document written by pipeline/reindex.py:
+
+        {"_id": "routing",
+         "active": {"index_name": ..., "embedding_model": ...,
+                    "min_relevance_score": ..., "score_gap_elbow": ...},
+         "shadow": {...same fields...,
+                    "mode": "shadow" | "ab", "fraction": 0.05}}
+
+    In "shadow" mode a sample of queries is also run against the shadow index
+    and compared; in "ab" mode a sample is served from it. Cutover rewrites
+    the document in one update, and workers pick it up within ROUTING_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self.routing: Optional[dict] = None
+        self.loaded_at = 0.0
+
+    @property
+    def routing_collection(self):
+        return clients.get_mongo_db().index_routing
+
+    def get_routing(self) -> dict:
+        if self.routing is None or time.monotonic() - self.loaded_at > ROUTING_CACHE_TTL:
+            try:
+                self.routing = self.routing_collection.find_one({"_id": "routing"}) or {}
+            except Exception as e:
+                # Keep serving from the last known routing if MongoDB is unavailable
+                logger.error(f"Error loading index routing: {str(e)}")
+                self.routing = self.routing or {}
+            self.loaded_at = time.monotonic()
+        return self.routing
+
+    def make_target(self, config: Optional[dict]) -> SearchTarget:
+        config = config or {}
+        index_name = config.get("index_name") or os.environ["PINECONE_INDEX"]
+        return SearchTarget(
+            index_name, clients.get_pinecone_index(index_name), *search_settings(config)
+        )
+
+    def choose_targets(self, allow_ab: bool = True) -> Tuple[SearchTarget, Optional[SearchTarget]]:
+        """Return (target to serve from, target to shadow-compare against or None)."""
+        routing = self.get_routing()
+        active = self.make_target(routing.get("active"))
+
+        shadow_config = routing.get("shadow")
+        if not shadow_config or random.random() >= shadow_config.get("fraction", 0):
+            return active, None
+
+        shadow = self.make_target(shadow_config)
+        if shadow_config.get("mode") == "ab" and allow_ab:
+            return shadow, active
+        return active, shadow
@@ -0,0 +1,68 @@
+from typing import List, Optional
+from datetime import datetime
+import re
+from services import clients
+
+# Same date forms the pipeline parses from sitting titles (pipeline/summarizer.py)
+MONTHS = "January|February|March|April|May|June|July|August|September|October|November|December"
+DATE_PATTERNS = [
+    (re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({MONTHS}),?\s+(\d{{4}})\b", re.I), "%d %B %Y", (1, 2, 3)),
+    (re.compile(rf"\b({MONTHS})\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b", re.I), "%d %B %Y", (2, 1, 3)),
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), "%d %m %Y", (3, 2, 1)),
+    (re.compile(r"\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b"), "%d %m %Y", (1, 2, 3)),
+]
+
+# "What was discussed on ...", "What happened in Parliament on ...", "Summarize the sitting of ..."
+OVERVIEW_QUESTION = re.compile(
+    r"\b(what\b.*\b(discuss|happen|debat|cover|agenda|business|take place|took place)\w*"
+    r"|summar(y|ise|ize)|overview|recap)\b",
+    re.I,
+)
+# Words an overview question may contain besides its date; anything else is a topic
+OVERVIEW_WORDS = {
+    "what", "whats", "was", "were", "is", "are", "did", "does", "do", "s", "there",
+    "discuss", "discussed", "happen", "happened", "debate", "debated", "cover", "covered",
+    "agenda", "business", "take", "took", "place", "summary", "summarise", "summarize",
+    "overview", "recap", "give", "me", "us", "tell", "can", "could", "you", "please",
+    "a", "an", "the", "in", "on", "of", "at", "during", "for", "about", "held",
+    "parliament", "parliamentary", "sitting", "session", "house", "proceedings", "day",
+    "ghana", "ghanas", "monday", "tuesday", "wednesday", "thursday", "friday",
+}
+
+
+def parse_question_date(question: str) -> Optional[str]:
+    """Find a date in a question, returned as YYYY-MM-DD."""
+    for pattern, date_format, order in DATE_PATTERNS:
+        match = pattern.search(question)
+        if not match:
+            continue
+        day, month, year = (match.group(i) for i in order)
+        try:
+            return datetime.strptime(f"{day} {month.title()} {year}", date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+class SummaryService:
+    """Looks up the per-sitting summaries written by pipeline/summarizer.py."""
+
+    @property
+    def summaries(self):
+        return clients.get_mongo_db().sitting_summaries
+
+    def is_overview_question(self, question: str) -> bool:
+        """Whether a question asks about a whole sitting, with no topic beyond its date."""
+        if not OVERVIEW_QUESTION.search(question):
+            return False
+        for pattern, _, _ in DATE_PATTERNS:
+            question = pattern.sub(" ", question)
+        words = re.findall(r"[a-z]+", question.lower().replace("'", ""))
+        return all(word in OVERVIEW_WORDS for word in words)
+
+    def find_sittings(self, question: str) -> List[dict]:
+        """Summaries of the sittings a question targets by date, if any."""
+        sitting_date = parse_question_date(question)
+        if not sitting_date:
+            return []
+        return list(self.summaries.find({"sitting_date": sitting_date}, {"_id": 0}))
@@ -0,0 +1,241 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import gzip
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TRANSCRIPTS_DIR = os.environ.get("TRANSCRIPTS_DIR", "./local_data/transcripts")
+TRANSCRIPT_INDEX_CACHE_SIZE = int(os.environ.get("TRANSCRIPT_INDEX_CACHE_SIZE", 64))
+
+# Compact formats first, matching pipeline/transcript_store.py. Parquet needs
+# pyarrow, which the API doesn't require; without it those files are skipped
+TRANSCRIPT_EXTENSIONS = [".parquet", ".jsonl", ".jsonl.gz", ".json"]
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+class TranscriptNotFound(Exception):
+    pass
+
+
+class TranscriptIndex:
+    """Segment start times of one transcript, mapped to where each segment lives.
+
+    For .jsonl files `offsets` holds the byte offset of every segment line
+    (plus the end of file), so a range read is a single seek and read. Parquet is read
+    by row through a memory map. Formats without random access (.json,
+    .jsonl.gz) are parsed once and kept in memory.
+
+    `starts` and `ends` are numpy arrays; numpy is imported only when a
+    transcript is first indexed, to keep it off the API's cold start.
+    """
+
+    def __init__(self, path: str, header: Dict, starts, ends):
+        self.path = path
+        self.header = header
+        self.starts = starts
+        self.ends = ends
+        self.offsets = None
+        self.table = None
+        self.segments: Optional[List[Dict]] = None
+
+    def row_range(self, start: float, end: Optional[float]) -> Tuple[int, int]:
+        """Rows of the segments overlapping [start, end)."""
+        first = max(int(self.starts.searchsorted(start, side="right")) - 1, 0)
+        if first < len(self.ends) and self.ends[first] <= start:
+            first += 1
+        last = len(self.starts) if end is None else int(self.starts.searchsorted(end))
+        return first, max(first, last)
+
+    def read_rows(self, first: int, last: int) -> List[Dict]:
+        if self.offsets is not None:
+            with open(self.path, "rb") as f:
+                f.seek(int(self.offsets[first]))
+                data = f.read(int(self.offsets[last] - self.offsets[first]))
+            return [json.loads(line) for line in data.splitlines()]
+        if self.table is not None:
+            return self.table.slice(first, last - first).to_pylist()
+        return self.segments[first:last]
+
+
+class TranscriptService:
+    def __init__(self, transcripts_dir: str = TRANSCRIPTS_DIR):
+        self.transcripts_dir = transcripts_dir
+        self.indexes: OrderedDict[str, TranscriptIndex] = OrderedDict()
+        self.extensions = TRANSCRIPT_EXTENSIONS
+        if importlib.util.find_spec("pyarrow") is None:
+            self.extensions = [ext for ext in TRANSCRIPT_EXTENSIONS if ext != ".parquet"]
+
+    def find_transcript(self, video_id: str) -> str:
+        """Transcripts are named `<video_id>_<title>.<ext>`."""
+        if not VIDEO_ID_PATTERN.match(video_id):
+            raise TranscriptNotFound
+        try:
+            filenames = os.listdir(self.transcripts_dir)
+        except FileNotFoundError:
+            raise TranscriptNotFound
+
+        candidates = [f for f in filenames if f.startswith(f"{video_id}_")]
+        for extension in self.extensions:
+            for filename in candidates:
+                if filename.endswith(extension):
+                    return os.path.join(self.transcripts_dir, filename)
+        if any(filename.endswith(".parquet") for filename in candidates):
+            logger.warning(f"Transcript of {video_id} is parquet, which needs pyarrow installed")
+        raise TranscriptNotFound
+
+    def get_etag(
+        self, video_id: str, start: float, end: Optional[float], limit: int, cursor: Optional[int] = None
+    ) -> str:
+        """Validator for a page, from the transcript file's identity and the range."""
+        path = self.find_transcript(video_id)
+        stat = os.stat(path)
+        key = f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{start}:{end}:{limit}:{cursor}"
+        return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    def get_index(self, video_id: str) -> TranscriptIndex:
+        path = self.find_transcript(video_id)
+        mtime = os.stat(path).st_mtime_ns
+        cache_key = f"{path}:{mtime}"
+
+        index = self.indexes.get(cache_key)
+        if index is None:
+            index = self.build_index(path)
+            self.indexes[cache_key] = index
+            if len(self.indexes) > TRANSCRIPT_INDEX_CACHE_SIZE:
+                self.indexes.popitem(last=False)
+        else:
+            self.indexes.move_to_end(cache_key)
+        return index
+
+    def build_index(self, path: str) -> TranscriptIndex:
+        import numpy as np
+
+        logger.info(f"Indexing transcript: {path}")
+
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(path, columns=["start", "end", "text"], memory_map=True)
+            header = json.loads(table.schema.metadata[b"transcript"])
+            index = TranscriptIndex(
+                path,
+                header,
+                table.column("start").to_numpy(),
+                table.column("end").to_numpy(),
+            )
+            index.table = table
+            return index
+
+        if path.endswith(".jsonl"):
+            return self.load_or_build_line_index(path)
+
+        if path.endswith(".jsonl.gz"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                segments = [json.loads(line) for line in f]
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                header = json.load(f)
+            segments = header.pop("segments")
+
+        segments = [
+            {"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+            for segment in segments
+        ]
+        index = TranscriptIndex(
+            path,
+            header,
+            np.array([segment["start"] for segment in segments]),
+            np.array([segment["end"] for segment in segments]),
+        )
+        index.segments = segments
+        return index
+
+    def load_or_build_line_index(self, path: str) -> TranscriptIndex:
+        """Byte-offset index of a .jsonl transcript, persisted next to it as .idx.npz."""
+        import numpy as np
+
+        index_path = f"{path}.idx.npz"
+        if os.path.exists(index_path) and os.stat(index_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            with np.load(index_path) as stored:
+                index = TranscriptIndex(
+                    path, json.loads(str(stored["header"])), stored["starts"], stored["ends"]
+                )
+                index.offsets = stored["offsets"]
+            return index
+
+        offsets, starts, ends = [], [], []
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            offset = f.tell()
+            for line in f:
+                segment = json.loads(line)
+                offsets.append(offset)
+                starts.append(segment["start"])
+                ends.append(segment["end"])
+                offset += len(line)
+            offsets.append(offset)
+
+        index = TranscriptIndex(path, header, np.array(starts), np.array(ends))
+        index.offsets = np.array(offsets, dtype=np.int64)
+
+        try:
+            temp_path = f"{index_path}.tmp.npz"
+            np.savez(
+                temp_path,
+                header=json.dumps(header),
+                starts=index.starts,
+                ends=index.ends,
+                offsets=index.offsets,
+            )
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            # Read-only deployments (e.g. Lambda) just keep the in-memory index
+            logger.warning(f"Could not persist transcript index {index_path}: {str(e)}")
+
+        return index
+
+    def get_transcript_page(
+        self,
+        video_id: str,
+        start: float,
+        end: Optional[float],
+        limit: int,
+        cursor: Optional[int] = None,
+    ) -> Dict:
+        """Return up to `limit` segments overlapping [start, end), plus the next cursor.
+
+        The cursor is a row number, so pages never skip segments sharing a start time.
+        """
+        index = self.get_index(video_id)
+        first, last = index.row_range(start, end)
+        if cursor is not None:
+            first = min(max(first, cursor), last)
+        page_last = min(last, first + limit)
+
+        segments = [
+            {
+                "start": segment["start"],
+                "end": segment["end"],
+                "text": segment["text"].strip(),
+                "timestamp_link": f'{index.header["video_url"]}&t={int(segment["start"])}s',
+            }
+            for segment in index.read_rows(first, page_last)
+        ]
+
+        return {
+            "video_id": index.header["video_id"],
+            "video_title": index.header["video_title"],
+            "video_url": index.header["video_url"],
+            "segments": segments,
+            "next_cursor": page_last if page_last < last else None,
+        }
@@ -0,0 +1,426 @@
+"""In-process vector search over compressed, memory-mapped embeddings.
+
+An index directory holds:
+    meta.json          quantization scheme, dimension and vector count, plus the
+                       embedding model and relevance cutoffs of the source index
+    codes.npy          int8 codes (vectors x dims), or pq codes (sub-spaces x vectors)
+    scales.npy         per-vector scales (int8 only)
+    codebooks.npy      sub-space centroids (pq only)
+    vectors.npy        the original float32 vectors, for exact re-ranking
+    metadata.jsonl     one JSON line of id + metadata per vector
+    offsets.npy        byte offset of each metadata line, plus the file size
+    video_ids.npy      each vector's video_id, for filtered searches
+
+Every array is opened with mmap, so resident memory is the compressed codes
+the scan touches plus the handful of float rows read for re-ranking.
+
+pq is the default: its scan reads 16x less than int8's and answers in a few
+milliseconds at 50k vectors. An int8 scan is bound by converting every code
+to float32 (about 40ms at 50k x 1536 on one core), so int8 only suits small
+indexes, or builds where skipping PQ training matters more than latency.
+
+Build one from the active Pinecone index (as routed by pipeline/reindex.py) with:
+    python -m services.vector_index build --out ./local_data/index [--quantization int8]
+
+With --version, the index is built in --out/<version> and --out/CURRENT is
+pointed at it once complete; servers whose LOCAL_INDEX_DIR is --out switch
+to it within INDEX_RELOAD_INTERVAL seconds, without restarting.
+"""
+from typing import Dict, List, NamedTuple, Optional
+from types import SimpleNamespace
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+RERANK_SHORTLIST_FACTOR = int(os.environ.get("RERANK_SHORTLIST_FACTOR", 20))
+PQ_SUBSPACES = int(os.environ.get("PQ_SUBSPACES", 96))
+PQ_CENTROIDS = 256  # one uint8 code per sub-space
+PQ_TRAINING_SAMPLE = 20000
+PQ_TRAINING_ITERATIONS = 15
+SCAN_BLOCK_ROWS = 256  # keeps the float32 scratch of an int8 scan in cache
+INDEX_RELOAD_INTERVAL = float(os.environ.get("INDEX_RELOAD_INTERVAL", 10))
+CURRENT_POINTER = "CURRENT"
+
+
+class Match(NamedTuple):
+    id: str
+    score: float
+    metadata: Dict
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors: np.ndarray):
+    """Symmetric per-vector int8 quantization. Returns (codes, scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def train_pq(vectors: np.ndarray, subspaces: int, seed: int = 0) -> np.ndarray:
+    """Train one k-means codebook per sub-space. Returns (subspaces, 256, dsub)."""
+    count, dimension = vectors.shape
+    if dimension % subspaces:
+        raise ValueError(f"Dimension {dimension} is not divisible by {subspaces} sub-spaces")
+    dsub = dimension // subspaces
+    rng = np.random.default_rng(seed)
+
+    sample = vectors[rng.choice(count, min(count, PQ_TRAINING_SAMPLE), replace=False)]
+    centroids = min(PQ_CENTROIDS, len(sample))
+    codebooks = np.zeros((subspaces, PQ_CENTROIDS, dsub), dtype=np.float32)
+
+    for m in range(subspaces):
+        points = sample[:, m * dsub : (m + 1) * dsub]
+        centers = points[rng.choice(len(points), centroids, replace=False)].copy()
+        for _ in range(PQ_TRAINING_ITERATIONS):
+            assignments = nearest_centroids(points, centers)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, assignments, points)
+            counts = np.bincount(assignments, minlength=centroids)
+            # Empty clusters keep their previous center
+            filled = counts > 0
+            centers[filled] = sums[filled] / counts[filled, None]
+        codebooks[m, :centroids] = centers
+        # Unused slots (tiny archives only) repeat a real centroid
+        codebooks[m, centroids:] = centers[0]
+
+    return codebooks
+
+
+def nearest_centroids(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    distances = (
+        (points ** 2).sum(axis=1)[:, None]
+        - 2 * points @ centers.T
+        + (centers ** 2).sum(axis=1)[None, :]
+    )
+    return distances.argmin(axis=1)
+
+
+def encode_pq(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    """Encode vectors as (subspaces, count) codes, contiguous per sub-space for scanning."""
+    subspaces, _, dsub = codebooks.shape
+    codes = np.empty((subspaces, len(vectors)), dtype=np.uint8)
+    for m in range(subspaces):
+        codes[m] = nearest_centroids(vectors[:, m * dsub : (m + 1) * dsub], codebooks[m])
+    return codes
+
+
+class QuantizedIndex:
+    """Read-only, memory-mapped index with a Pinecone-compatible `query`."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        self.quantization = self.meta["quantization"]
+        self.count = self.meta["count"]
+        self.codes = self.load_array("codes.npy")
+        self.vectors = self.load_array("vectors.npy")
+        self.offsets = self.load_array("offsets.npy")
+        if self.quantization == "int8":
+            self.scales = self.load_array("scales.npy")
+        else:
+            self.codebooks = np.load(os.path.join(index_dir, "codebooks.npy"))
+        self.metadata_fd = os.open(os.path.join(index_dir, "metadata.jsonl"), os.O_RDONLY)
+        if os.path.exists(os.path.join(index_dir, "video_ids.npy")):
+            self.video_ids = self.load_array("video_ids.npy")
+        else:
+            # Built before video_ids.npy existed: parse once here, not per search
+            logger.warning(f"No video_ids.npy in {index_dir}; reading video ids from the metadata")
+            self.video_ids = np.array([metadata["video_id"] for metadata in self.iter_metadata()])
+
+        logger.info(
+            f"Opened {self.quantization} index with {self.count} vectors from {index_dir}"
+        )
+
+    def load_array(self, filename: str) -> np.ndarray:
+        return np.load(os.path.join(self.index_dir, filename), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        if getattr(self, "metadata_fd", None) is not None:
+            os.close(self.metadata_fd)
+            self.metadata_fd = None
+
+    def __del__(self):
+        # A replaced version is closed once the last search using it returns
+        self.close()
+
+    @classmethod
+    def build(
+        cls,
+        index_dir: str,
+        ids: List[str],
+        vectors: np.ndarray,
+        metadata: List[Dict],
+        quantization: str = "pq",
+        version: Optional[str] = None,
+        search_config: Optional[Dict] = None,
+    ) -> "QuantizedIndex":
+        """Write an index directory from float vectors and their metadata.
+
+        search_config holds the source index's embedding_model, min_relevance_score
+        and score_gap_elbow, which queries against this index must use.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+
+        if quantization == "int8":
+            codes, scales = quantize_int8(vectors)
+            np.save(os.path.join(index_dir, "scales.npy"), scales)
+        elif quantization == "pq":
+            codebooks = train_pq(vectors, PQ_SUBSPACES)
+            codes = encode_pq(vectors, codebooks)
+            np.save(os.path.join(index_dir, "codebooks.npy"), codebooks)
+        else:
+            raise ValueError(f"Unknown quantization: {quantization}")
+
+        np.save(os.path.join(index_dir, "codes.npy"), codes)
+        np.save(os.path.join(index_dir, "vectors.npy"), vectors)
+
+        offsets = []
+        with open(os.path.join(index_dir, "metadata.jsonl"), "wb") as f:
+            for vector_id, vector_metadata in zip(ids, metadata):
+                offsets.append(f.tell())
+                line = json.dumps({"id": vector_id, "metadata": vector_metadata}, ensure_ascii=False)
+                f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+        np.save(os.path.join(index_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        # Fixed-width strings, so filters can mmap them instead of parsing metadata.jsonl
+        np.save(
+            os.path.join(index_dir, "video_ids.npy"),
+            np.array([vector_metadata["video_id"] for vector_metadata in metadata], dtype=str),
+        )
+
+        # meta.json last: a directory without it is an incomplete build
+        with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "quantization": quantization,
+                    "dimension": vectors.shape[1],
+                    "count": len(vectors),
+                    "version": version,
+                    **(search_config or {}),
+                },
+                f,
+            )
+
+        logger.info(
+            f"Built {quantization} index of {len(vectors)} vectors: codes {codes.nbytes} bytes, "
+            f"float vectors {vectors.nbytes} bytes"
+        )
+        return cls(index_dir)
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Score every vector against the query using only the compressed codes."""
+        if self.quantization == "pq":
+            subspaces, _, dsub = self.codebooks.shape
+            # Inner product of each query sub-vector with every centroid
+            lookup = np.einsum("mkd,md->mk", self.codebooks, query.reshape(subspaces, dsub))
+            scores = np.zeros(self.count, dtype=np.float32)
+            for m in range(subspaces):
+                scores += lookup[m].take(self.codes[m])
+            return scores
+
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            block = self.codes[start : start + SCAN_BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32) @ query
+        return scores * self.scales
+
+    def read_metadata(self, row: int) -> Dict:
+        # pread keeps concurrent searches from sharing a file position
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self.metadata_fd, end - start, start))
+
+    def iter_metadata(self):
+        with open(os.path.join(self.index_dir, "metadata.jsonl"), "rb") as f:
+            for line in f:
+                yield json.loads(line)["metadata"]
+
+    def filter_rows(self, metadata_filter: Dict) -> np.ndarray:
+        """Rows matching a Pinecone-style filter; only video_id equality and $in are supported."""
+        if set(metadata_filter) != {"video_id"}:
+            raise ValueError(f"Unsupported filter: {metadata_filter}")
+        condition = metadata_filter["video_id"]
+        if isinstance(condition, dict):
+            values = condition.get("$in", [condition.get("$eq")])
+        else:
+            values = [condition]
+        return np.flatnonzero(np.isin(self.video_ids, values))
+
+    def search(
+        self,
+        vector: List[float],
+        top_k: int,
+        shortlist_factor: int = RERANK_SHORTLIST_FACTOR,
+        metadata_filter: Optional[Dict] = None,
+    ) -> List[Match]:
+        """Return the top_k matches by cosine similarity."""
+        if not self.count:
+            return []
+        query = normalize(np.asarray(vector, dtype=np.float32))
+
+        if metadata_filter:
+            # A filter narrows the search to a few sittings: score those rows exactly
+            shortlist = self.filter_rows(metadata_filter)
+            return self.rank(shortlist, self.vectors[shortlist] @ query, top_k)
+
+        # Shortlist on compressed scores, then re-rank it with the exact float vectors
+        scores = self.approximate_scores(query)
+        shortlist_size = min(len(scores), top_k * shortlist_factor)
+        shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size]
+        shortlist.sort()  # sequential reads from the mmapped vectors
+
+        return self.rank(shortlist, self.vectors[shortlist] @ query, top_k)
+
+    def rank(self, rows: np.ndarray, exact_scores: np.ndarray, top_k: int) -> List[Match]:
+        """The top_k of `rows` by their exact scores, with metadata."""
+        best = np.argsort(-exact_scores)[:top_k]
+
+        matches = []
+        for position in best:
+            row = self.read_metadata(rows[position])
+            matches.append(Match(row["id"], float(exact_scores[position]), row["metadata"]))
+        return matches
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        include_metadata: bool = True,
+        filter: Optional[Dict] = None,
+        **kwargs,
+    ):
+        """Pinecone-compatible query, so QueryService can use either index."""
+        return SimpleNamespace(matches=self.search(vector, top_k, metadata_filter=filter))
+
+
+class VersionedIndex:
+    """Serve the index version named in {root}/CURRENT, following it when it changes.
+
+    The pointer is re-read at most every INDEX_RELOAD_INTERVAL seconds. A new
+    version is opened alongside the old one and swapped in; searches already
+    running finish on the old version.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.index: Optional[QuantizedIndex] = None
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self.refresh()
+
+    def current_version(self) -> str:
+        with open(os.path.join(self.root, CURRENT_POINTER), "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def refresh(self):
+        if self.index is not None and time.monotonic() - self.checked_at < INDEX_RELOAD_INTERVAL:
+            return
+        with self.lock:
+            if self.index is not None and time.monotonic() - self.checked_at < INDEX_RELOAD_INTERVAL:
+                return
+            self.checked_at = time.monotonic()
+            try:
+                version = self.current_version()
+                if version != self.version:
+                    self.index = QuantizedIndex(os.path.join(self.root, version))
+                    self.version = version
+                    logger.info(f"Serving local index version {version}")
+            except (OSError, ValueError) as e:
+                if self.index is None:
+                    raise
+                # Keep serving the version already open
+                logger.error(f"Error loading local index from {self.root}: {str(e)}")
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.index)
+
+    @property
+    def meta(self) -> Dict:
+        self.refresh()
+        return self.index.meta
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True, **kwargs):
+        self.refresh()
+        return self.index.query(vector, top_k, include_metadata, **kwargs)
+
+
+def publish(root: str, version: str):
+    """Atomically point {root}/CURRENT at a built version."""
+    pointer_path = os.path.join(root, CURRENT_POINTER)
+    with open(pointer_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(pointer_path + ".tmp", pointer_path)
+    logger.info(f"Published local index version {version}")
+
+
+def export_pinecone(index, batch_size: int = 100):
+    """Fetch every vector id, value and metadata from a Pinecone index."""
+    ids, vectors, metadata = [], [], []
+    for page in index.list():
+        for batch_start in range(0, len(page), batch_size):
+            fetched = index.fetch(ids=page[batch_start : batch_start + batch_size])
+            for vector_id, vector in fetched.vectors.items():
+                ids.append(vector_id)
+                vectors.append(vector.values)
+                metadata.append(vector.metadata)
+        logger.info(f"Exported {len(ids)} vectors")
+    return ids, np.array(vectors, dtype=np.float32), metadata
+
+
+def main():
+    from services.routing_service import RoutingService
+
+    parser = argparse.ArgumentParser(description="Local quantized vector index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="build a local index from the active Pinecone index")
+    build.add_argument("--out", required=True)
+    build.add_argument("--quantization", choices=["int8", "pq"], default="pq")
+    build.add_argument("--version", help="build into --out/VERSION and publish it as CURRENT")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        routing_service = RoutingService()
+        target = routing_service.make_target(routing_service.get_routing().get("active"))
+        logger.info(f"Exporting {target.name} ({target.embedding_model})")
+        ids, vectors, metadata = export_pinecone(target.index)
+        search_config = {
+            "index_name": target.name,
+            "embedding_model": target.embedding_model,
+            "min_relevance_score": target.min_relevance_score,
+            "score_gap_elbow": target.score_gap_elbow,
+        }
+        if args.version:
+            index_dir = os.path.join(args.out, args.version)
+            QuantizedIndex.build(
+                index_dir, ids, vectors, metadata, args.quantization, args.version, search_config
+            )
+            publish(args.out, args.version)
+        else:
+            QuantizedIndex.build(
+                args.out, ids, vectors, metadata, args.quantization, search_config=search_config
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import logging
+from typing import Dict, List
+import tiktoken
+from transcript_store import format_timestamp
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 400))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 50))
+TOKEN_ENCODING = "cl100k_base"  # tokenizer used by the OpenAI embedding models
+
+
+class SegmentChunker:
+    """Group consecutive transcript segments into token-bounded, overlapping windows."""
+
+    def __init__(
+        self,
+        max_tokens: int = CHUNK_MAX_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    ):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def make_chunk(self, window: List[Dict]) -> Dict:
+        """Build a chunk that keeps the timing of its first and last segment."""
+        return {
+            "text": " ".join(segment["text"].strip() for segment in window),
+            "start": window[0]["start"],
+            "end": window[-1]["end"],
+        }
+
+    def chunk(self, segments: List[Dict]) -> List[Dict]:
+        """Split segments into chunks of at most max_tokens (a longer segment stands alone)."""
+        chunks = []
+        window: List[Dict] = []
+        window_tokens: List[int] = []
+
+        for segment in segments:
+            tokens = self.count_tokens(segment["text"])
+
+            if window and sum(window_tokens) + tokens > self.max_tokens:
+                chunks.append(self.make_chunk(window))
+
+                # Carry trailing segments over so context spans chunk boundaries,
+                # always dropping at least the first segment to make progress
+                carried = 0
+                overlap_from = len(window)
+                while (
+                    overlap_from > 1
+                    and carried + window_tokens[overlap_from - 1] <= self.overlap_tokens
+                ):
+                    overlap_from -= 1
+                    carried += window_tokens[overlap_from]
+                window = window[overlap_from:]
+                window_tokens = window_tokens[overlap_from:]
+
+                # The carried segments plus this one may still not fit
+                while window and sum(window_tokens) + tokens > self.max_tokens:
+                    window.pop(0)
+                    window_tokens.pop(0)
+
+            window.append(segment)
+            window_tokens.append(tokens)
+
+        if window:
+            chunks.append(self.make_chunk(window))
+
+        logger.info(f"Chunked {len(segments)} segments into {len(chunks)} chunks")
+        return chunks
+
+    def chunk_transcript(self, transcript_data: Dict) -> List[Dict]:
+        """Chunk a transcript into texts with the metadata stored alongside each vector."""
+        chunks = []
+        for chunk in self.chunk(transcript_data["segments"]):
+            timestamp = format_timestamp(chunk["start"])
+            video_link = f'{transcript_data["video_url"]}&t={int(chunk["start"])}s'
+
+            chunks.append(
+                {
+                    "text": chunk["text"],
+                    "metadata": {
+                        "video_id": transcript_data["video_id"],
+                        "video_url": transcript_data["video_url"],
+                        "video_title": transcript_data["video_title"],
+                        "timestamp": timestamp,
+                        "timestamp_link": video_link,
+                        "start": chunk["start"],
+                        "end": chunk["end"],
+                    },
+                }
+            )
+
+        return chunks
@@ -1,8 +1,14 @@
 import os
-from typing import List, Dict
+import json
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
 import logging
+import requests
 from pytubefix import YouTube
-from pytubefix.cli import on_progress
 from googleapiclient.discovery import build
 import pathlib
 from dotenv import load_dotenv
@@ -18,19 +24,92 @@ logger.setLevel(logging.INFO)
 YOUTUBE_API_KEY = os.environ["YOUTUBE_API_KEY"]
 CHANNEL_ID = os.environ["CHANNEL_ID"]
 DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", "./local_data/audio")
-MAX_VIDEOS = 4
+MAX_VIDEOS = int(os.environ.get("MAX_VIDEOS", 4))  # 0 backfills the whole channel
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", 4))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+# googlevideo throttles open-ended requests to about playback speed, but not
+# bounded ranges of this size (the same size pytubefix requests)
+DOWNLOAD_RANGE_SIZE = int(os.environ.get("DOWNLOAD_RANGE_SIZE", 9 * 1024 * 1024))
+MANIFEST_PATH = os.path.join(DOWNLOAD_DIR, "manifest.json")
 
 # Create download directory if it doesn't exist
 pathlib.Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
 
+class DownloadManifest:
+    """Size and SHA-256 of every completed download, shared between download threads."""
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_complete(self, filepath: str) -> bool:
+        """A download is complete only if recorded and its content still matches.
+
+        The SHA-256 is re-checked whenever the file was modified since it was recorded.
+        """
+        entry = self.entries.get(os.path.basename(filepath))
+        if not entry or not os.path.exists(filepath):
+            return False
+        stat = os.stat(filepath)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry.get("mtime_ns"):
+            return True
+
+        if file_sha256(filepath) != entry["sha256"]:
+            logger.warning(f"Checksum mismatch for {filepath}; downloading it again")
+            return False
+        with self.lock:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self.save()
+        return True
+
+    def record(self, filepath: str, video: Dict, size: int, sha256: str):
+        with self.lock:
+            self.entries[os.path.basename(filepath)] = {
+                "video_id": video["video_id"],
+                "title": video["title"],
+                "published_at": video["published_at"],
+                "size": size,
+                "sha256": sha256,
+                "mtime_ns": os.stat(filepath).st_mtime_ns,
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self.save()
+
+    def save(self):
+        # Write-then-rename so a crash never leaves a truncated manifest
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def file_sha256(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class YoutubeAudioDownloader:
-    def __init__(self):
+    def __init__(self, max_videos: int = MAX_VIDEOS, concurrency: int = DOWNLOAD_CONCURRENCY):
         # Initialize YouTube API client
         self.youtube = build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+        self.max_videos = max_videos
+        self.concurrency = concurrency
+        self.manifest = DownloadManifest()
 
     def get_recent_videos(self) -> List[Dict]:
-        """Get the most recent videos from the channel."""
+        """Get the most recent videos from the channel (all of them if max_videos is 0)."""
         videos = []
+        next_page_token = None
 
         response = (
             self.youtube.channels()
@@ -42,61 +121,146 @@ class YoutubeAudioDownloader:
             "relatedPlaylists"
         ]["uploads"]
 
-        # Retrieve only the most recent videos
-        playlist_response = (
-            self.youtube.playlistItems()
-            .list(
-                part="snippet",
-                playlistId=uploads_playlist_id,
-                maxResults=MAX_VIDEOS
+        # Page through the uploads playlist, newest first
+        while True:
+            remaining = self.max_videos - len(videos) if self.max_videos else 50
+            playlist_response = (
+                self.youtube.playlistItems()
+                .list(
+                    part="snippet",
+                    playlistId=uploads_playlist_id,
+                    maxResults=min(remaining, 50),
+                    pageToken=next_page_token,
+                )
+                .execute()
             )
-            .execute()
-        )
 
-        for item in playlist_response["items"]:
-            video_id = item["snippet"]["resourceId"]["videoId"]
-            snippet = item["snippet"]
-            video_info = {
-                "video_id": video_id,
-                "title": snippet["title"],
-            }
-            videos.append(video_info)
+            for item in playlist_response["items"]:
+                video_id = item["snippet"]["resourceId"]["videoId"]
+                snippet = item["snippet"]
+                video_info = {
+                    "video_id": video_id,
+                    "title": snippet["title"],
+                    "published_at": snippet["publishedAt"],
+                }
+                videos.append(video_info)
+
+            next_page_token = playlist_response.get("nextPageToken")
+            if not next_page_token or (self.max_videos and len(videos) >= self.max_videos):
+                break
 
-        return videos
+        return videos[: self.max_videos] if self.max_videos else videos
 
-    def download_to_disk(self, video: Dict) -> None:
-        """Download video to local disk."""
+    def get_filepath(self, video: Dict) -> str:
+        # Create safe filename
+        safe_title = "".join(c for c in video['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        filename = f"{video['video_id']}_{safe_title[:50]}.mp3"
+        return os.path.join(DOWNLOAD_DIR, filename)
+
+    def download_stream(self, url: str, part_path: str, expected_size: Optional[int]):
+        """Download into part_path in bounded ranges, resuming from whatever it already holds."""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size and offset >= expected_size:
+            offset = 0  # stale or oversized partial file; start over
+        if offset:
+            logger.info(f"Resuming {part_path} from byte {offset}")
+
+        with requests.Session() as session, open(part_path, "r+b" if offset else "wb") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            while not expected_size or offset < expected_size:
+                range_end = offset + DOWNLOAD_RANGE_SIZE - 1
+                if expected_size:
+                    range_end = min(range_end, expected_size - 1)
+
+                response = session.get(url, headers={"Range": f"bytes={offset}-{range_end}"}, timeout=60)
+                if response.status_code == 416:
+                    break  # past the end of a stream of unknown size
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(f"Range request ignored (status {response.status_code})")
+
+                f.write(response.content)
+                requested = range_end - offset + 1
+                offset += len(response.content)
+                if len(response.content) < requested:
+                    break  # a short range is the end of the stream
+
+    def check_partial(self, part_path: str, stream):
+        """Discard a partial download of a different stream, then record which one it holds.
+
+        Resuming appends bytes by offset, so they must come from the same itag and size.
+        """
+        info_path = f"{part_path}.json"
+        info = {"itag": stream.itag, "size": stream.filesize}
+        if os.path.exists(part_path):
+            previous = None
+            if os.path.exists(info_path):
+                with open(info_path, "r", encoding="utf-8") as f:
+                    previous = json.load(f)
+            if previous != info:
+                logger.info(f"Discarding {part_path}, which holds a different stream")
+                os.remove(part_path)
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+    def download_to_disk(self, video: Dict) -> bool:
+        """Download video audio to local disk. Returns whether the file is complete."""
         try:
+            filepath = self.get_filepath(video)
+
+            # Skip if a verified download already exists
+            if self.manifest.is_complete(filepath):
+                logger.info(f"File already exists: {filepath}")
+                return True
+
             # Get video stream URL using pytube
             logger.info(f"https://www.youtube.com/watch?v={video['video_id']}")
-            yt = YouTube(
-                f"https://www.youtube.com/watch?v={video['video_id']}",
-                on_progress_callback=on_progress
-            )
+            yt = YouTube(f"https://www.youtube.com/watch?v={video['video_id']}")
             stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
 
             if not stream:
                 logger.error(f"No suitable stream found for video {video['video_id']}")
-                return
+                return False
 
-            # Create safe filename
-            safe_title = "".join(c for c in video['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            filename = f"{video['video_id']}_{safe_title[:50]}.mp3"
-            filepath = os.path.join(DOWNLOAD_DIR, filename)
+            expected_size = stream.filesize
 
-            # Skip if file already exists
             if os.path.exists(filepath):
-                logger.info(f"File already exists: {filepath}")
-                return
+                # Adopt files downloaded before the manifest existed, if they're whole.
+                # A recorded file that failed verification is corrupt, so replace it.
+                recorded = os.path.basename(filepath) in self.manifest.entries
+                if not recorded and os.path.getsize(filepath) == expected_size:
+                    self.manifest.record(filepath, video, expected_size, file_sha256(filepath))
+                    logger.info(f"Verified existing file: {filepath}")
+                    return True
+                os.remove(filepath)
 
-            # Download the file
+            # Download to a temporary file, renamed into place only once complete
+            part_path = f"{filepath}.part"
+            self.check_partial(part_path, stream)
             logger.info(f"Downloading {video['title']} to {filepath}")
-            stream.download(output_path=DOWNLOAD_DIR, filename=filename)
-            
+            for attempt in range(1, DOWNLOAD_RETRIES + 1):
+                try:
+                    self.download_stream(stream.url, part_path, expected_size)
+                    break
+                except requests.RequestException as e:
+                    logger.warning(f"Attempt {attempt} downloading {video['video_id']} failed: {str(e)}")
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+
+            size = os.path.getsize(part_path)
+            if expected_size and size != expected_size:
+                raise IOError(f"Incomplete download: {size} of {expected_size} bytes")
+
+            os.replace(part_path, filepath)
+            os.remove(f"{part_path}.json")
+            self.manifest.record(filepath, video, size, file_sha256(filepath))
             logger.info(f"Successfully downloaded {video['title']}")
+            return True
 
         except Exception as e:
             logger.error(f"Error downloading video {video['video_id']}: {str(e)}")
+            return False
 
     def sync_videos(self):
         """Main synchronization process."""
@@ -106,14 +270,20 @@ class YoutubeAudioDownloader:
             videos = self.get_recent_videos()
             logger.info(f"Found {len(videos)} recent videos")
 
-            # Download each video
-            for video in videos:
-                self.download_to_disk(video)
+            # Download videos concurrently
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                results = list(executor.map(self.download_to_disk, videos))
+            logger.info(f"{sum(results)} of {len(videos)} videos downloaded")
 
         except Exception as e:
             logger.error(f"Error in sync_videos: {str(e)}")
             raise
 
 if __name__ == "__main__":
-    downloader = YoutubeAudioDownloader()
+    parser = argparse.ArgumentParser(description="Download audio from the parliament channel")
+    parser.add_argument("--max-videos", type=int, default=MAX_VIDEOS, help="0 for the whole channel")
+    parser.add_argument("--concurrency", type=int, default=DOWNLOAD_CONCURRENCY)
+    args = parser.parse_args()
+
+    downloader = YoutubeAudioDownloader(args.max_videos, args.concurrency)
     downloader.sync_videos()
\ No newline at end of file
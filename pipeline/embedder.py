@@ -1,11 +1,13 @@
 import os
-import json
 import logging
 from typing import List, Dict
 from pinecone import Pinecone, ServerlessSpec
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai.embeddings import OpenAIEmbeddings
+from pymongo import MongoClient
 from dotenv import load_dotenv
+from transcript_store import list_transcripts, read_transcript
+from chunker import SegmentChunker
+from reindex import get_write_targets, mark_completed
 
 load_dotenv()
 
@@ -17,15 +19,15 @@ logger = logging.getLogger(__name__)
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
 PINECONE_API_KEY = os.environ["PINECONE_API_KEY"]
 PINECONE_INDEX = os.environ["PINECONE_INDEX"]
+MONGODB_URI = os.environ["MONGODB_URI"]
+MONGODB_DB = os.environ["MONGODB_DB"]
 TRANSCRIPTS_DIR = "./pipeline/local_data/transcripts"
+UPSERT_BATCH_SIZE = 100
 
 
 class VectorStoreManager:
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=100
-        )
+        self.chunker = SegmentChunker()
 
         self.pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
         
@@ -43,79 +45,72 @@ class VectorStoreManager:
             )
         else:
             logger.info(f'Pinecone Index {PINECONE_INDEX} found. Using it.')
-        self.index = self.pinecone_client.Index(PINECONE_INDEX)
 
-    def format_timestamp(self, seconds: float) -> str:
-        """Convert seconds to HH:MM:SS format."""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        seconds = int(seconds % 60)
-        if hours > 0:
-            return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        return f"{minutes:02d}:{seconds:02d}"
-
-    def process_transcript(self, transcript_path: str) -> List[Dict]:
-        """Process transcript into segments with metadata."""
-        with open(transcript_path, "r", encoding="utf-8") as f:
-            transcript_data = json.load(f)
-
-        segments = []
-        for segment in transcript_data["segments"]:
-            timestamp = self.format_timestamp(segment["start"])
-            video_link = f'{transcript_data["video_url"]}&t={int(segment["start"])}s'
-
-            segments.append(
-                {
-                    "text": segment["text"],
-                    "metadata": {
-                        "video_id": transcript_data["video_id"],
-                        "video_url": transcript_data["video_url"],
-                        "video_title": transcript_data["video_title"],
-                        "timestamp": timestamp,
-                        "timestamp_link": video_link,
-                        "start": segment["start"],
-                        "end": segment["end"],
-                    },
-                }
+        # Write to whichever index serves queries (see reindex.py), and to any
+        # index version not yet cut over, so none falls behind
+        self.mongo_client = MongoClient(MONGODB_URI)
+        self.db = self.mongo_client[MONGODB_DB]
+        self.targets = []
+        for config in get_write_targets(self.db):
+            logger.info(f"Writing to index {config['index_name']} ({config['embedding_model']})")
+            self.targets.append(
+                (
+                    config.get("version"),
+                    self.pinecone_client.Index(config["index_name"]),
+                    OpenAIEmbeddings(model=config["embedding_model"]),
+                )
             )
 
-        return segments
+    def process_transcript(self, transcript_path: str) -> List[Dict]:
+        """Process transcript into token-bounded chunks with metadata."""
+        return self.chunker.chunk_transcript(read_transcript(transcript_path))
+
+    def delete_stale_vectors(self, index, video_id: str, chunk_count: int):
+        """Remove a video's vectors left over from an older chunking that made more chunks."""
+        stale_ids = [
+            vector_id
+            for ids in index.list(prefix=f"{video_id}_")
+            for vector_id in ids
+            if int(vector_id.rsplit("_", 1)[1]) >= chunk_count
+        ]
+        for batch_start in range(0, len(stale_ids), UPSERT_BATCH_SIZE):
+            index.delete(ids=stale_ids[batch_start : batch_start + UPSERT_BATCH_SIZE])
 
     def update_vectorstore(self, transcript_paths: List[str]):
         """Update Pinecone with new transcripts."""
         for transcript_path in transcript_paths:
-            segments = self.process_transcript(transcript_path)
-
-            # Create embeddings and upsert to Pinecone
-            for i, segment in enumerate(segments):
-                # Create unique ID for each segment
-                segment_id = f"{segment['metadata']['video_id']}_{i}"
-
-                # Get embedding for segment text
-                embedding = self.embeddings.embed_query(segment["text"])
-
-                # Upsert to Pinecone
-                self.index.upsert(
-                    vectors=[
-                        (
-                            segment_id,
-                            embedding,
-                            {"text": segment["text"], **segment["metadata"]},
-                        )
+            try:
+                chunks = self.process_transcript(transcript_path)
+                if not chunks:
+                    continue
+
+                video_id = chunks[0]["metadata"]["video_id"]
+                for version, index, embeddings_model in self.targets:
+                    # Embed every chunk in batched requests
+                    embeddings = embeddings_model.embed_documents([chunk["text"] for chunk in chunks])
+
+                    vectors = [
+                        (f"{video_id}_{i}", embedding, {"text": chunk["text"], **chunk["metadata"]})
+                        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
                     ]
-                )
 
-            logger.info(f"Processed and uploaded transcript: {transcript_path}")
+                    # Overwrite in place so the video stays searchable throughout,
+                    # then drop ids beyond the new chunk count
+                    for batch_start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+                        index.upsert(vectors=vectors[batch_start : batch_start + UPSERT_BATCH_SIZE])
+                    self.delete_stale_vectors(index, video_id, len(vectors))
+                    if version:
+                        mark_completed(self.db, version, video_id)
+
+                logger.info(f"Processed and uploaded {len(chunks)} chunks from transcript: {transcript_path}")
+            except Exception as e:
+                logger.error(f"Error updating vectors for {transcript_path}: {str(e)}")
 
 
 def main():
     # Process all transcripts in the directory
     manager = VectorStoreManager()
-    transcript_paths = [
-        os.path.join(TRANSCRIPTS_DIR, f)
-        for f in os.listdir(TRANSCRIPTS_DIR)
-        if f.endswith(".json")
-    ]
+    transcript_paths = list_transcripts(TRANSCRIPTS_DIR)
     manager.update_vectorstore(transcript_paths)
 
 
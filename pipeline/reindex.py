@@ -0,0 +1,414 @@
+"""Rebuild the vector index with a new embedding model without taking search down.
+
+Usage:
+    python reindex.py build --version v2 --model text-embedding-3-small
+    python reindex.py shadow --version v2 [--mode shadow|ab] [--fraction 0.05]
+    python reindex.py cutover --version v2
+    python reindex.py rollback
+    python reindex.py status
+
+`build` embeds the stored transcripts into a new Pinecone index named
+{PINECONE_INDEX}-{version}, throttled to REINDEX_TPM / REINDEX_RPM and backing
+off whenever the API reports that the key's own limits are running low, so
+production queries keep their headroom. Progress is recorded per video in the
+`index_versions` collection and an interrupted build resumes where it stopped.
+
+`shadow` makes the backend also query the new index for a sample of requests,
+either only to compare latency and overlap (recorded in `index_comparisons`)
+or, in "ab" mode, to serve the sampled requests from it. `cutover` embeds any
+transcripts the version is still missing, then promotes it in a single update
+of the `index_routing` document; `rollback` swaps back. Until cutover,
+embedder.py writes new transcripts to every version being built or built.
+"""
+import os
+import re
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from openai import OpenAI, RateLimitError
+from pinecone import Pinecone, ServerlessSpec
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from transcript_store import list_transcripts, read_transcript
+from chunker import SegmentChunker
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+PINECONE_API_KEY = os.environ["PINECONE_API_KEY"]
+PINECONE_INDEX = os.environ["PINECONE_INDEX"]
+MONGODB_URI = os.environ["MONGODB_URI"]
+MONGODB_DB = os.environ["MONGODB_DB"]
+TRANSCRIPTS_DIR = "./local_data/transcripts"
+REINDEX_TPM = int(os.environ.get("REINDEX_TPM", 100_000))  # embedding tokens per minute
+REINDEX_RPM = int(os.environ.get("REINDEX_RPM", 60))  # embedding requests per minute
+# Pause when less than this share of the key's own limits is left for production
+REINDEX_MIN_HEADROOM = float(os.environ.get("REINDEX_MIN_HEADROOM", 0.5))
+REINDEX_BATCH_SIZE = int(os.environ.get("REINDEX_BATCH_SIZE", 256))
+UPSERT_BATCH_SIZE = 100
+MAX_RETRIES = 6
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+# Starting relevance cutoffs per model: text-embedding-3 scores related text far
+# lower than ada-002 does. Tune them with the shadow comparisons.
+MIN_RELEVANCE_SCORES = {
+    "text-embedding-ada-002": 0.75,
+    "text-embedding-3-small": 0.35,
+    "text-embedding-3-large": 0.35,
+}
+DEFAULT_SCORE_GAP_ELBOW = 0.04
+DEFAULT_ACTIVE = {"index_name": PINECONE_INDEX, "embedding_model": DEFAULT_EMBEDDING_MODEL}
+
+
+def get_routing(db) -> Dict:
+    """The backend's index routing; the original index when nothing has been cut over."""
+    routing = db.index_routing.find_one({"_id": "routing"}) or {}
+    routing.setdefault("active", DEFAULT_ACTIVE)
+    return routing
+
+
+def get_write_targets(db) -> List[Dict]:
+    """Every index new transcripts must reach: active, shadow, and versions not yet cut over.
+
+    Writing to versions still building (or built but not yet shadowed) keeps
+    transcripts that arrive mid-build from being missing after cutover.
+    """
+    routing = get_routing(db)
+    targets = [routing[role] for role in ("active", "shadow") if role in routing]
+    index_names = {target["index_name"] for target in targets}
+    for record in db.index_versions.find({"status": {"$in": ["building", "built"]}}, {"completed_videos": 0}):
+        if record["index_name"] not in index_names:
+            targets.append(
+                {
+                    "version": record["_id"],
+                    "index_name": record["index_name"],
+                    "embedding_model": record["embedding_model"],
+                }
+            )
+    return targets
+
+
+def mark_completed(db, version: str, video_id: str):
+    """Record that a version's index holds a video's vectors, so builds skip it."""
+    db.index_versions.update_one(
+        {"_id": version},
+        {
+            "$addToSet": {"completed_videos": video_id},
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+        },
+    )
+
+
+def parse_reset(value: Optional[str]) -> float:
+    """Seconds from an x-ratelimit-reset-* header such as "1m30s", "6s" or "250ms"."""
+    if not value:
+        return 1.0
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value)) or 1.0
+
+
+class Throttle:
+    """Spread embedding requests evenly over a tokens- and requests-per-minute budget."""
+
+    def __init__(self, tokens_per_minute: int = REINDEX_TPM, requests_per_minute: int = REINDEX_RPM):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.next_request_at = time.monotonic()
+
+    def wait(self, tokens: int):
+        now = time.monotonic()
+        if self.next_request_at > now:
+            time.sleep(self.next_request_at - now)
+        interval = max(60 * tokens / self.tokens_per_minute, 60 / self.requests_per_minute)
+        self.next_request_at = max(now, self.next_request_at) + interval
+
+    def observe(self, headers):
+        """Back off until reset when the key's remaining limits fall below the headroom."""
+        for kind in ("tokens", "requests"):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if not limit or not remaining:
+                continue
+            if int(remaining) < int(limit) * REINDEX_MIN_HEADROOM:
+                delay = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                logger.info(f"Only {remaining}/{limit} {kind} left on the key; pausing {delay:.1f}s")
+                self.next_request_at = max(self.next_request_at, time.monotonic() + delay)
+
+
+class Reindexer:
+    def __init__(self):
+        self.client = OpenAI()
+        self.pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
+        self.mongo_client = MongoClient(MONGODB_URI)
+        self.db = self.mongo_client[MONGODB_DB]
+        self.versions = self.db.index_versions
+        self.chunker = SegmentChunker()
+        self.throttle = Throttle()
+
+    def get_version(self, version: str) -> Dict:
+        record = self.versions.find_one({"_id": version})
+        if record is None:
+            raise SystemExit(f"Unknown index version {version}; build it first")
+        return record
+
+    @staticmethod
+    def routing_config(version: str, record: Dict) -> Dict:
+        """How the backend should query a version, as stored in `index_routing`."""
+        return {
+            "version": version,
+            "index_name": record["index_name"],
+            "embedding_model": record["embedding_model"],
+            "min_relevance_score": record["min_relevance_score"],
+            "score_gap_elbow": record["score_gap_elbow"],
+        }
+
+    def create_index(self, index_name: str, dimension: int):
+        index_names = [index["name"] for index in self.pinecone_client.list_indexes().get("indexes")]
+        if index_name in index_names:
+            logger.info(f"Pinecone Index {index_name} found. Resuming into it.")
+            return
+        logger.info(f"Creating Pinecone Index {index_name} ({dimension} dimensions)")
+        self.pinecone_client.create_index(
+            index_name,
+            dimension=dimension,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        )
+
+    def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed texts within the reindex budget, retrying when rate limited anyway."""
+        embeddings = []
+        for batch_start in range(0, len(texts), REINDEX_BATCH_SIZE):
+            batch = texts[batch_start : batch_start + REINDEX_BATCH_SIZE]
+            tokens = sum(self.chunker.count_tokens(text) for text in batch)
+
+            for attempt in range(MAX_RETRIES):
+                self.throttle.wait(tokens)
+                try:
+                    raw_response = self.client.embeddings.with_raw_response.create(model=model, input=batch)
+                    break
+                except RateLimitError as e:
+                    delay = parse_reset(e.response.headers.get("x-ratelimit-reset-tokens")) * (2**attempt)
+                    logger.info(f"Rate limited; retrying in {delay:.1f}s")
+                    self.throttle.next_request_at = time.monotonic() + delay
+            else:
+                raise RuntimeError(f"Still rate limited after {MAX_RETRIES} attempts")
+
+            self.throttle.observe(raw_response.headers)
+            embeddings.extend(item.embedding for item in raw_response.parse().data)
+        return embeddings
+
+    def build(
+        self,
+        version: str,
+        model: str,
+        dimension: Optional[int] = None,
+        min_score: Optional[float] = None,
+        score_gap: float = DEFAULT_SCORE_GAP_ELBOW,
+    ):
+        dimension = dimension or EMBEDDING_DIMENSIONS.get(model)
+        if dimension is None:
+            raise SystemExit(f"Unknown dimension for {model}; pass --dimension")
+        min_score = MIN_RELEVANCE_SCORES.get(model) if min_score is None else min_score
+        if min_score is None:
+            raise SystemExit(f"No default relevance cutoff for {model}; pass --min-score")
+
+        index_name = f"{PINECONE_INDEX}-{version}"
+        record = self.versions.find_one({"_id": version})
+        if record and (record["embedding_model"] != model or record["index_name"] != index_name):
+            raise SystemExit(f"Version {version} was started with {record['embedding_model']}; pick a new version")
+
+        now = datetime.now(timezone.utc)
+        self.versions.update_one(
+            {"_id": version},
+            {
+                "$set": {
+                    "status": "building",
+                    "min_relevance_score": min_score,
+                    "score_gap_elbow": score_gap,
+                    "updated_at": now,
+                },
+                "$setOnInsert": {
+                    "index_name": index_name,
+                    "embedding_model": model,
+                    "dimension": dimension,
+                    "completed_videos": [],
+                    "created_at": now,
+                },
+            },
+            upsert=True,
+        )
+        self.create_index(index_name, dimension)
+        index = self.pinecone_client.Index(index_name)
+
+        completed = set(self.get_version(version)["completed_videos"])
+        transcript_paths = list_transcripts(TRANSCRIPTS_DIR)
+        for transcript_path in transcript_paths:
+            video_id = os.path.basename(transcript_path)[:11]
+            if video_id in completed:
+                continue
+
+            chunks = self.chunker.chunk_transcript(read_transcript(transcript_path))
+            embeddings = self.embed([chunk["text"] for chunk in chunks], model)
+            vectors = [
+                (f"{video_id}_{i}", embedding, {"text": chunk["text"], **chunk["metadata"]})
+                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+            ]
+            for batch_start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+                index.upsert(vectors=vectors[batch_start : batch_start + UPSERT_BATCH_SIZE])
+
+            mark_completed(self.db, version, video_id)
+            completed.add(video_id)
+            logger.info(f"[{len(completed)}/{len(transcript_paths)}] Reindexed {len(chunks)} chunks from {transcript_path}")
+
+        self.versions.update_one(
+            {"_id": version}, {"$set": {"status": "built", "updated_at": datetime.now(timezone.utc)}}
+        )
+        logger.info(f"Index version {version} built in {index_name}")
+
+    def shadow(self, version: str, mode: str, fraction: float):
+        record = self.get_version(version)
+        if record["status"] != "built":
+            raise SystemExit(f"Index version {version} is still {record['status']}")
+
+        self.db.index_routing.update_one(
+            {"_id": "routing"},
+            {
+                "$set": {
+                    "shadow": {
+                        **self.routing_config(version, record),
+                        "mode": mode,
+                        "fraction": fraction,
+                    },
+                    "updated_at": datetime.now(timezone.utc),
+                },
+                "$setOnInsert": {"active": DEFAULT_ACTIVE},
+            },
+            upsert=True,
+        )
+        logger.info(f"Index version {version} in {mode} mode for {fraction:.0%} of queries")
+
+    def cutover(self, version: str):
+        record = self.get_version(version)
+        if record["status"] != "built":
+            raise SystemExit(f"Index version {version} is still {record['status']}")
+
+        # Catch up on transcripts that arrived since the build, before serving from it
+        self.build(
+            version,
+            record["embedding_model"],
+            record["dimension"],
+            record["min_relevance_score"],
+            record["score_gap_elbow"],
+        )
+        record = self.get_version(version)
+        previous_version = get_routing(self.db)["active"].get("version")
+
+        # One pipeline update: the previous active config is kept for rollback
+        self.db.index_routing.update_one(
+            {"_id": "routing"},
+            [
+                {
+                    "$set": {
+                        "previous": {"$ifNull": ["$active", DEFAULT_ACTIVE]},
+                        "active": {"$literal": self.routing_config(version, record)},
+                        "updated_at": datetime.now(timezone.utc),
+                    }
+                },
+                {"$unset": "shadow"},
+            ],
+            upsert=True,
+        )
+        # A live version is written to as the active index; a retired one no longer
+        self.versions.update_one({"_id": version}, {"$set": {"status": "live"}})
+        if previous_version:
+            self.versions.update_one({"_id": previous_version}, {"$set": {"status": "retired"}})
+        logger.info(f"Cut over to index version {version} ({record['index_name']})")
+
+    def rollback(self):
+        result = self.db.index_routing.update_one(
+            {"_id": "routing", "previous": {"$exists": True}},
+            [
+                {
+                    "$set": {
+                        "active": "$previous",
+                        "previous": "$active",
+                        "updated_at": datetime.now(timezone.utc),
+                    }
+                },
+                {"$unset": "shadow"},
+            ],
+        )
+        if not result.matched_count:
+            raise SystemExit("Nothing to roll back to")
+
+        routing = get_routing(self.db)
+        if routing["active"].get("version"):
+            self.versions.update_one({"_id": routing["active"]["version"]}, {"$set": {"status": "live"}})
+        if routing["previous"].get("version"):
+            # Kept up to date again, so it can be cut over to later
+            self.versions.update_one({"_id": routing["previous"]["version"]}, {"$set": {"status": "built"}})
+        logger.info(f"Rolled back to {routing['active']['index_name']}")
+
+    def status(self):
+        routing = get_routing(self.db)
+        for role in ("active", "shadow", "previous"):
+            if role in routing:
+                logger.info(f"{role}: {routing[role]}")
+        for record in self.versions.find().sort("created_at", 1):
+            logger.info(
+                f"version {record['_id']}: {record['status']}, {len(record['completed_videos'])} videos, "
+                f"{record['embedding_model']} in {record['index_name']}, "
+                f"min score {record['min_relevance_score']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="embed all transcripts into a new index version")
+    build_parser.add_argument("--version", required=True)
+    build_parser.add_argument("--model", required=True)
+    build_parser.add_argument("--dimension", type=int, help="for models not in EMBEDDING_DIMENSIONS")
+    build_parser.add_argument("--min-score", type=float, help="relevance cutoff for this model's scores")
+    build_parser.add_argument("--score-gap", type=float, default=DEFAULT_SCORE_GAP_ELBOW)
+
+    shadow_parser = subparsers.add_parser("shadow", help="shadow-read or A/B a built version")
+    shadow_parser.add_argument("--version", required=True)
+    shadow_parser.add_argument("--mode", choices=["shadow", "ab"], default="shadow")
+    shadow_parser.add_argument("--fraction", type=float, default=0.05)
+
+    cutover_parser = subparsers.add_parser("cutover", help="serve all queries from a built version")
+    cutover_parser.add_argument("--version", required=True)
+
+    subparsers.add_parser("rollback", help="serve from the previously active index again")
+    subparsers.add_parser("status", help="show routing and index versions")
+    args = parser.parse_args()
+
+    reindexer = Reindexer()
+    if args.command == "build":
+        reindexer.build(args.version, args.model, args.dimension, args.min_score, args.score_gap)
+    elif args.command == "shadow":
+        reindexer.shadow(args.version, args.mode, args.fraction)
+    elif args.command == "cutover":
+        reindexer.cutover(args.version)
+    elif args.command == "rollback":
+        reindexer.rollback()
+    else:
+        reindexer.status()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from openai import OpenAI
+from pymongo import MongoClient, ASCENDING
+from dotenv import load_dotenv
+from transcript_store import format_timestamp, list_transcripts, read_transcript
+from chunker import SegmentChunker
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+MONGODB_URI = os.environ["MONGODB_URI"]
+MONGODB_DB = os.environ["MONGODB_DB"]
+AUDIO_DIR = "./local_data/audio"
+TRANSCRIPTS_DIR = "./local_data/transcripts"
+MANIFEST_PATH = os.path.join(AUDIO_DIR, "manifest.json")
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_WINDOW_TOKENS = int(os.environ.get("SUMMARY_WINDOW_TOKENS", 3000))
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", 4))
+
+MONTHS = "January|February|March|April|May|June|July|August|September|October|November|December"
+DATE_PATTERNS = [
+    # 12th November, 2024
+    (re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({MONTHS}),?\s+(\d{{4}})\b", re.I), "%d %B %Y", (1, 2, 3)),
+    # November 12th, 2024
+    (re.compile(rf"\b({MONTHS})\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b", re.I), "%d %B %Y", (2, 1, 3)),
+    # 2024-11-12
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), "%d %m %Y", (3, 2, 1)),
+    # 12/11/2024 (day first)
+    (re.compile(r"\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b"), "%d %m %Y", (1, 2, 3)),
+]
+
+WINDOW_PROMPT = """You summarize part of a sitting of Ghana's Parliament for regular people.
+Write a short, objective summary of this excerpt: the business taken, bills or motions
+discussed, key arguments, and any decisions. Name speakers only when the transcript does."""
+
+SITTING_PROMPT = """You summarize a full sitting of Ghana's Parliament for regular people, from
+summaries of consecutive parts of the sitting. Write a clear, objective overview of what
+was discussed and decided, in order, using accessible language.
+
+After the summary, suggest 3 relevant follow-up questions in this exact format:
+
+FOLLOW_UP_QUESTIONS:
+{
+    "questions": [
+        {
+            "text": "First follow-up question",
+            "category": "one of: [Related Bill, Debate Context, Impact Analysis, Procedure, Timeline, Key Players]",
+            "context": "Brief explanation of why this question is relevant"
+        }
+    ]
+}"""
+
+
+def parse_sitting_date(text: str) -> Optional[str]:
+    """Find a date in free text, returned as YYYY-MM-DD."""
+    for pattern, date_format, order in DATE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        day, month, year = (match.group(i) for i in order)
+        try:
+            return datetime.strptime(f"{day} {month.title()} {year}", date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+class SittingSummarizer:
+    """Map-reduce summaries of each sitting: per window of transcript, then per sitting."""
+
+    def __init__(self):
+        self.client = OpenAI()
+        self.window_chunker = SegmentChunker(max_tokens=SUMMARY_WINDOW_TOKENS, overlap_tokens=0)
+
+        self.mongo_client = MongoClient(MONGODB_URI)
+        self.summaries = self.mongo_client[MONGODB_DB].sitting_summaries
+        self.summaries.create_index([("video_id", ASCENDING)], unique=True)
+        self.summaries.create_index([("sitting_date", ASCENDING)])
+
+        # The downloader's manifest keeps each video's full title and publish time;
+        # transcript titles come from filenames, which are sanitized and truncated
+        self.downloads: Dict[str, Dict] = {}
+        if os.path.exists(MANIFEST_PATH):
+            with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+                self.downloads = json.load(f)
+
+    def complete(self, system_prompt: str, content: str, max_tokens: int) -> str:
+        completion = self.client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content},
+            ],
+            temperature=0,
+            max_tokens=max_tokens,
+        )
+        return completion.choices[0].message.content.strip()
+
+    def summarize_windows(self, transcript_data: Dict) -> List[Dict]:
+        """Map step: summarize each token-bounded window of the transcript."""
+        windows = self.window_chunker.chunk(transcript_data["segments"])
+
+        def summarize(window: Dict) -> Dict:
+            return {
+                "start": window["start"],
+                "end": window["end"],
+                "timestamp": format_timestamp(window["start"]),
+                "timestamp_link": f'{transcript_data["video_url"]}&t={int(window["start"])}s',
+                "summary": self.complete(WINDOW_PROMPT, window["text"], max_tokens=400),
+            }
+
+        with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as executor:
+            return list(executor.map(summarize, windows))
+
+    def reduce_summaries(self, title: str, summaries: List[str]) -> str:
+        """Reduce step: fold window summaries into one, in rounds if they don't fit."""
+        while self.window_chunker.count_tokens("\n\n".join(summaries)) > SUMMARY_WINDOW_TOKENS:
+            groups, group = [], []
+            for summary in summaries:
+                if group and self.window_chunker.count_tokens("\n\n".join(group + [summary])) > SUMMARY_WINDOW_TOKENS:
+                    groups.append(group)
+                    group = []
+                group.append(summary)
+            groups.append(group)
+
+            if len(groups) == len(summaries):
+                # Each summary alone is too large to combine; stop folding
+                break
+            summaries = [
+                self.complete(WINDOW_PROMPT, "\n\n".join(group), max_tokens=600) for group in groups
+            ]
+
+        return self.complete(
+            SITTING_PROMPT, f"Sitting: {title}\n\n" + "\n\n".join(summaries), max_tokens=1200
+        )
+
+    def get_sitting_info(self, transcript_data: Dict) -> Tuple[str, Optional[str]]:
+        """The sitting's full title and date, preferring the downloader's record of the video.
+
+        The date is taken from the title, else from when the video was published.
+        """
+        download = self.downloads.get(transcript_data.get("audio_filename"), {})
+        title = download.get("title") or transcript_data["video_title"]
+        sitting_date = parse_sitting_date(title)
+        if not sitting_date and download.get("published_at"):
+            sitting_date = download["published_at"][:10]
+        return title, sitting_date
+
+    def summarize_transcript(self, transcript_path: str) -> Optional[Dict]:
+        transcript_data = read_transcript(transcript_path)
+        if not transcript_data["segments"]:
+            return None
+
+        title, sitting_date = self.get_sitting_info(transcript_data)
+        window_summaries = self.summarize_windows(transcript_data)
+        full_response = self.reduce_summaries(
+            title, [window["summary"] for window in window_summaries]
+        )
+
+        parts = full_response.split("FOLLOW_UP_QUESTIONS:")
+        follow_up_questions = []
+        if len(parts) > 1:
+            try:
+                follow_up_questions = json.loads(parts[1].strip())["questions"]
+            except json.JSONDecodeError:
+                logger.error("Failed to parse follow-up questions JSON")
+
+        return {
+            "video_id": transcript_data["video_id"],
+            "video_url": transcript_data["video_url"],
+            "video_title": title,
+            "sitting_date": sitting_date,
+            "summary": parts[0].strip(),
+            "follow_up_questions": follow_up_questions,
+            "window_summaries": window_summaries,
+            "model": SUMMARY_MODEL,
+            "created_at": datetime.now(timezone.utc),
+        }
+
+    def process_new_transcripts(self, transcript_paths: List[str]) -> List[str]:
+        """Summarize transcripts that have no stored summary yet."""
+        existing_video_ids = set(
+            doc["video_id"] for doc in self.summaries.find({}, {"video_id": 1})
+        )
+
+        summarized = []
+        for transcript_path in transcript_paths:
+            video_id = os.path.basename(transcript_path)[:11]
+            if video_id in existing_video_ids:
+                continue
+
+            try:
+                summary = self.summarize_transcript(transcript_path)
+                if summary:
+                    self.summaries.replace_one({"video_id": summary["video_id"]}, summary, upsert=True)
+                    summarized.append(summary["video_id"])
+                    logger.info(f"Summarized sitting: {summary['video_title']}")
+            except Exception as e:
+                logger.error(f"Error summarizing {transcript_path}: {str(e)}")
+
+        return summarized
+
+
+def main():
+    summarizer = SittingSummarizer()
+    summarizer.process_new_transcripts(list_transcripts(TRANSCRIPTS_DIR))
+
+
+if __name__ == "__main__":
+    main()
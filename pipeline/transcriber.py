@@ -1,15 +1,17 @@
 import os
 import json
+import hashlib
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional
-from openai import OpenAI
+from typing import Dict, List, Optional, Set, Tuple
 from pydub import AudioSegment
 import tempfile
 from datetime import datetime
 import shutil
 
 from dotenv import load_dotenv
+from transcript_store import TRANSCRIPT_FORMATS, find_transcript, transcript_path, write_transcript
+from transcription_backends import get_backend
 
 load_dotenv()
 
@@ -18,75 +20,88 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Environment variables and constants
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")  # only needed by the openai backend
 AUDIO_DIR = "./local_data/audio"
 TRANSCRIPTS_DIR = "./local_data/transcripts"
+CHECKPOINT_DIR = "./local_data/checkpoints"
 CHUNK_LENGTH = 10 * 60 * 1000  # 10 minutes in milliseconds
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB in bytes
+TRANSCRIPT_FORMAT = os.environ.get("TRANSCRIPT_FORMAT", "json")  # see transcript_store.py
+
+if TRANSCRIPT_FORMAT not in TRANSCRIPT_FORMATS:
+    raise ValueError(f"Unknown TRANSCRIPT_FORMAT: {TRANSCRIPT_FORMAT}")
 
 class WhisperTranscriber:
     def __init__(self):
         Path(TRANSCRIPTS_DIR).mkdir(parents=True, exist_ok=True)
-        self.client = OpenAI()
+        self.backend = get_backend()
 
-    def get_video_info_from_filename(self, filename: str) -> str:
-        """Extract video ID from filename (format: videoId_title.mp3)."""
-        return tuple(filename.split('_'))
+    def get_video_info_from_filename(self, filename: str) -> Tuple[str, str]:
+        """Extract video ID and title from filename (format: videoId_title.mp3)."""
+        # Video IDs are 11 characters and may themselves contain underscores
+        stem = os.path.splitext(filename)[0]
+        return stem[:11], stem[12:]
 
-    def split_audio(self, audio_path: str) -> List[str]:
-        """Split audio file into smaller chunks."""
+    def split_audio(self, audio_path: str, temp_dir: str, skip: Set[int] = frozenset()) -> List[Optional[str]]:
+        """Split audio file into smaller chunks. Chunks in `skip` are not exported (None)."""
         logger.info(f"Splitting audio file: {audio_path}")
-        
-        # Create temporary directory for chunks
-        temp_dir = tempfile.mkdtemp()
         chunk_paths = []
 
-        try:
-            # Load audio file
-            audio = AudioSegment.from_file(audio_path)
-            
-            # Split audio into chunks
-            for i, start in enumerate(range(0, len(audio), CHUNK_LENGTH)):
-                end = start + CHUNK_LENGTH
-                chunk = audio[start:end]
-                
-                # Save chunk to temporary file
-                chunk_path = os.path.join(temp_dir, f"chunk_{i:03d}.mp3")
-                chunk.export(chunk_path, format="mp3")
-                chunk_paths.append(chunk_path)
-                
-            logger.info(f"Split audio into {len(chunk_paths)} chunks")
-            return chunk_paths
-
-        except Exception as e:
-            logger.error(f"Error splitting audio file: {str(e)}")
-            shutil.rmtree(temp_dir)
-            raise
-
-    def transcribe_chunk(self, chunk_path: str, start_time: float = 0) -> Optional[Dict]:
+        # Load audio file
+        audio = AudioSegment.from_file(audio_path)
+
+        # Split audio into chunks
+        for i, start in enumerate(range(0, len(audio), CHUNK_LENGTH)):
+            if i in skip:
+                chunk_paths.append(None)
+                continue
+
+            end = start + CHUNK_LENGTH
+            chunk = audio[start:end]
+
+            # Save chunk to temporary file
+            chunk_path = os.path.join(temp_dir, f"chunk_{i:03d}.mp3")
+            chunk.export(chunk_path, format="mp3")
+            chunk_paths.append(chunk_path)
+
+        logger.info(f"Split audio into {len(chunk_paths)} chunks ({len(skip)} already checkpointed)")
+        return chunk_paths
+
+    def get_audio_hash(self, audio_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(audio_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get_checkpoint_dir(self, audio_hash: str) -> str:
+        """Checkpoints are keyed by audio content, chunking and model, so any change invalidates them."""
+        model_key = f"{self.backend.name}-{self.backend.model}-{CHUNK_LENGTH}"
+        return os.path.join(CHECKPOINT_DIR, audio_hash, model_key)
+
+    def load_checkpoints(self, checkpoint_dir: str) -> Dict[int, List[Dict]]:
+        checkpoints = {}
+        if os.path.isdir(checkpoint_dir):
+            for filename in os.listdir(checkpoint_dir):
+                if filename.startswith("chunk_") and filename.endswith(".json"):
+                    with open(os.path.join(checkpoint_dir, filename), "r", encoding="utf-8") as f:
+                        checkpoints[int(filename[6:-5])] = json.load(f)
+        return checkpoints
+
+    def save_checkpoint(self, checkpoint_dir: str, chunk_index: int, segments: List[Dict]):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoint_path = os.path.join(checkpoint_dir, f"chunk_{chunk_index:03d}.json")
+        temp_path = f"{checkpoint_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(segments, f, ensure_ascii=False)
+        os.replace(temp_path, checkpoint_path)
+
+    def clear_checkpoints(self, audio_hash: str):
+        shutil.rmtree(os.path.join(CHECKPOINT_DIR, audio_hash), ignore_errors=True)
+
+    def transcribe_chunk(self, chunk_path: str, start_time: float = 0) -> Optional[List[Dict]]:
         """Transcribe a single audio chunk."""
-        try:
-            with open(chunk_path, "rb") as audio_file:
-                transcript = self.client.audio.transcriptions.create(
-                    file=audio_file,
-                    model="whisper-1",
-                    response_format="verbose_json",
-                    timestamp_granularities=["segment"]
-                )
-
-            # Adjust timestamps based on chunk position
-            adjusted_segments = []
-            for segment in transcript.segments:
-                adjusted_segment = dict(segment)
-                adjusted_segment["start"] += start_time
-                adjusted_segment["end"] += start_time
-                adjusted_segments.append(adjusted_segment)
-
-            return adjusted_segments
-
-        except Exception as e:
-            logger.error(f"Error transcribing chunk {chunk_path}: {str(e)}")
-            return None
+        return self.backend.transcribe_chunk(chunk_path, start_time)
 
     def merge_transcripts(self, segments: List[Dict]) -> Dict:
         """Merge transcript segments and ensure continuous timing."""
@@ -103,42 +118,67 @@ class WhisperTranscriber:
         return merged_segments
 
     def transcribe_audio(self, audio_path: str) -> Optional[Dict]:
-        """Transcribe audio file by splitting into chunks and merging results."""
+        """Transcribe audio file by splitting into chunks and merging results.
+
+        Every successful chunk is checkpointed, so a rerun after a failure only
+        transcribes the missing chunks. Returns None unless every chunk succeeded.
+        """
         try:
             logger.info(f"Processing: {audio_path}")
-            
-            # Split audio into chunks
-            chunk_paths = self.split_audio(audio_path)
-            temp_dir = os.path.dirname(chunk_paths[0])
-            
+
+            audio_hash = self.get_audio_hash(audio_path)
+            checkpoint_dir = self.get_checkpoint_dir(audio_hash)
+            checkpoints = self.load_checkpoints(checkpoint_dir)
+
+            # Create temporary directory for chunks
+            temp_dir = tempfile.mkdtemp()
+
             try:
-                # Process each chunk
+                # Split audio into chunks, skipping the ones already transcribed
+                chunk_paths = self.split_audio(audio_path, temp_dir, skip=set(checkpoints))
+
+                # Chunks are fixed-length, so each one's offset is known up front
+                # and the backend is free to transcribe them in parallel
+                missing = [i for i, chunk_path in enumerate(chunk_paths) if chunk_path]
+                chunks = [(chunk_paths[i], i * CHUNK_LENGTH / 1000) for i in missing]
+                logger.info(f"Transcribing {len(chunks)} chunks with the {self.backend.name} backend")
+
+                # Checkpoint each chunk as soon as it finishes, so a crash part way
+                # through keeps everything transcribed so far
+                failed = []
+                for position, segments in self.backend.transcribe_chunks(chunks):
+                    i = missing[position]
+                    if segments is None:
+                        failed.append(i)
+                        continue
+                    self.save_checkpoint(checkpoint_dir, i, segments)
+                    checkpoints[i] = segments
+
+                if failed:
+                    logger.error(
+                        f"{len(failed)} of {len(chunk_paths)} chunks failed for {audio_path}; "
+                        "rerun to transcribe only those"
+                    )
+                    return None
+
                 all_segments = []
-                current_time = 0
-                
-                for chunk_path in chunk_paths:
-                    logger.info(f"Transcribing chunk: {chunk_path}")
-                    segments = self.transcribe_chunk(chunk_path, current_time)
-                    
-                    if segments:
-                        all_segments.extend(segments)
-                        # Update current_time for next chunk
-                        if segments:
-                            current_time = max(seg["end"] for seg in segments)
-                    
+                for i in range(len(chunk_paths)):
+                    all_segments.extend(checkpoints[i])
+
                 if not all_segments:
                     return None
 
                 # Merge segments
                 merged_segments = self.merge_transcripts(all_segments)
                 
-                video_id, video_title = self.get_video_id_from_filename(os.path.basename(audio_path))
+                video_id, video_title = self.get_video_info_from_filename(os.path.basename(audio_path))
                 
                 transcript_data = {
                     "video_id": video_id,
                     "video_url": f"https://youtube.com/watch?v={video_id}",
                     "video_title": video_title,
                     "audio_filename": os.path.basename(audio_path),
+                    "audio_sha256": audio_hash,
                     "segments": merged_segments,
                     "processed_at": datetime.now().isoformat(),
                 }
@@ -161,20 +201,24 @@ class WhisperTranscriber:
             audio_files = [f for f in os.listdir(AUDIO_DIR) if f.endswith('.mp3')]
             
             for audio_filename in audio_files:
-                transcript_path = os.path.join(TRANSCRIPTS_DIR, f"{os.path.splitext(audio_filename)[0]}.json")
-                
-                if os.path.exists(transcript_path):
-                    processed_transcripts.append(transcript_path)
+                stem = os.path.splitext(audio_filename)[0]
+                existing_transcript = find_transcript(TRANSCRIPTS_DIR, stem)
+
+                if existing_transcript:
+                    processed_transcripts.append(existing_transcript)
                     continue
 
                 audio_path = os.path.join(AUDIO_DIR, audio_filename)
                 transcript_data = self.transcribe_audio(audio_path)
 
                 if transcript_data:
-                    with open(transcript_path, 'w', encoding='utf-8') as f:
-                        json.dump(transcript_data, f, ensure_ascii=False, indent=2)
-                    processed_transcripts.append(transcript_path)
-                    logger.info(f"Saved transcript to: {transcript_path}")
+                    output_path = transcript_path(TRANSCRIPTS_DIR, stem, TRANSCRIPT_FORMAT)
+                    write_transcript(output_path, transcript_data)
+                    processed_transcripts.append(output_path)
+                    logger.info(f"Saved transcript to: {output_path}")
+
+                    # The transcript is complete, so its chunk checkpoints are no longer needed
+                    self.clear_checkpoints(transcript_data["audio_sha256"])
 
         except Exception as e:
             logger.error(f"Error in process_new_audios: {str(e)}")
@@ -183,7 +227,10 @@ class WhisperTranscriber:
 
 def main():
     transcriber = WhisperTranscriber()
-    transcriber.process_new_audios()
+    try:
+        transcriber.process_new_audios()
+    finally:
+        transcriber.backend.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Read and write transcripts in the legacy JSON format or a compact one.
+
+Formats, chosen by file extension:
+    .json      legacy: the full transcript with every Whisper segment field
+    .jsonl     one header line, then one compact line per segment
+    .jsonl.gz  gzip-compressed .jsonl
+    .parquet   columnar segments, memory-mapped on read (needs pyarrow)
+
+The compact formats keep only the segment columns downstream stages use.
+
+Convert an existing archive with:
+    python transcript_store.py convert --format parquet [--dir DIR] [--remove-source]
+"""
+import os
+import gzip
+import json
+import logging
+import argparse
+from typing import Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRANSCRIPTS_DIR = "./local_data/transcripts"
+TRANSCRIPT_FORMATS = {
+    "json": ".json",
+    "jsonl": ".jsonl",
+    "jsonl.gz": ".jsonl.gz",
+    "parquet": ".parquet",
+}
+# When a transcript exists in several formats, the most compact one wins
+PREFERRED_FORMATS = ["parquet", "jsonl.gz", "jsonl", "json"]
+SEGMENT_COLUMNS = ["start", "end", "text"]
+
+
+def get_format(path: str) -> str:
+    """Return the transcript format of a path from its extension."""
+    for fmt, extension in TRANSCRIPT_FORMATS.items():
+        if path.endswith(extension):
+            return fmt
+    raise ValueError(f"Unknown transcript format: {path}")
+
+
+def get_format_or_none(path: str) -> Optional[str]:
+    try:
+        return get_format(path)
+    except ValueError:
+        return None
+
+
+def transcript_path(transcripts_dir: str, stem: str, fmt: str) -> str:
+    return os.path.join(transcripts_dir, f"{stem}{TRANSCRIPT_FORMATS[fmt]}")
+
+
+def transcript_stem(path: str) -> str:
+    """Return the file name of a transcript without its format extension."""
+    filename = os.path.basename(path)
+    return filename[: -len(TRANSCRIPT_FORMATS[get_format(filename)])]
+
+
+def find_transcript(transcripts_dir: str, stem: str) -> Optional[str]:
+    """Return the path of an existing transcript in any format, if there is one."""
+    for fmt in PREFERRED_FORMATS:
+        path = transcript_path(transcripts_dir, stem, fmt)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def list_transcripts(transcripts_dir: str) -> List[str]:
+    """List transcripts in any format, one path per transcript."""
+    stems = {
+        transcript_stem(filename)
+        for filename in os.listdir(transcripts_dir)
+        if get_format_or_none(filename)
+    }
+
+    return [find_transcript(transcripts_dir, stem) for stem in sorted(stems)]
+
+
+def format_timestamp(seconds: float) -> str:
+    """Convert seconds to HH:MM:SS format."""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    seconds = int(seconds % 60)
+    if hours > 0:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The parquet transcript format requires pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def compact_segments(segments: List[Dict]) -> List[Dict]:
+    return [{column: segment[column] for column in SEGMENT_COLUMNS} for segment in segments]
+
+
+def write_transcript(path: str, transcript_data: Dict):
+    """Write a transcript atomically, in the format implied by the path."""
+    fmt = get_format(path)
+    header = {key: value for key, value in transcript_data.items() if key != "segments"}
+    segments = transcript_data["segments"]
+    temp_path = f"{path}.tmp"
+
+    if fmt == "json":
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(transcript_data, f, ensure_ascii=False, indent=2)
+
+    elif fmt in ("jsonl", "jsonl.gz"):
+        opener = gzip.open if fmt == "jsonl.gz" else open
+        with opener(temp_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for segment in compact_segments(segments):
+                f.write(json.dumps(segment, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    elif fmt == "parquet":
+        pa = import_pyarrow()
+        table = pa.table(
+            {
+                "start": pa.array([segment["start"] for segment in segments], pa.float64()),
+                "end": pa.array([segment["end"] for segment in segments], pa.float64()),
+                "text": pa.array([segment["text"] for segment in segments], pa.string()),
+            }
+        )
+        table = table.replace_schema_metadata({"transcript": json.dumps(header, ensure_ascii=False)})
+        pa.parquet.write_table(table, temp_path, compression="zstd")
+
+    os.replace(temp_path, path)
+
+
+def read_transcript(path: str, columns: List[str] = SEGMENT_COLUMNS) -> Dict:
+    """Read a transcript in any format. Segments carry only the requested columns."""
+    fmt = get_format(path)
+
+    if fmt == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            transcript_data = json.load(f)
+        transcript_data["segments"] = [
+            {column: segment[column] for column in columns}
+            for segment in transcript_data["segments"]
+        ]
+        return transcript_data
+
+    if fmt in ("jsonl", "jsonl.gz"):
+        opener = gzip.open if fmt == "jsonl.gz" else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            transcript_data = json.loads(f.readline())
+            transcript_data["segments"] = [
+                {column: segment[column] for column in columns}
+                for segment in map(json.loads, f)
+            ]
+        return transcript_data
+
+    pa = import_pyarrow()
+    table = pa.parquet.read_table(path, columns=columns, memory_map=True)
+    transcript_data = json.loads(table.schema.metadata[b"transcript"])
+    transcript_data["segments"] = table.to_pylist()
+    return transcript_data
+
+
+def convert_archive(transcripts_dir: str, fmt: str, remove_source: bool = False) -> List[str]:
+    """Convert every legacy JSON transcript in a directory to another format."""
+    converted = []
+    for filename in sorted(os.listdir(transcripts_dir)):
+        if get_format_or_none(filename) != "json":
+            continue
+
+        source_path = os.path.join(transcripts_dir, filename)
+        target_path = transcript_path(transcripts_dir, transcript_stem(filename), fmt)
+        if os.path.exists(target_path):
+            continue
+
+        with open(source_path, "r", encoding="utf-8") as f:
+            transcript_data = json.load(f)
+        write_transcript(target_path, transcript_data)
+        converted.append(target_path)
+
+        logger.info(
+            f"Converted {filename}: {os.path.getsize(source_path)} -> {os.path.getsize(target_path)} bytes"
+        )
+        if remove_source:
+            os.remove(source_path)
+
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript storage tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="convert JSON transcripts to a compact format")
+    convert.add_argument("--format", choices=[f for f in TRANSCRIPT_FORMATS if f != "json"], default="parquet")
+    convert.add_argument("--dir", default=TRANSCRIPTS_DIR)
+    convert.add_argument("--remove-source", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        converted = convert_archive(args.dir, args.format, args.remove_source)
+        logger.info(f"Converted {len(converted)} transcripts to {args.format}")
+
+
+if __name__ == "__main__":
+    main()
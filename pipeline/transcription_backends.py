@@ -0,0 +1,184 @@
+"""Speech-to-text backends for WhisperTranscriber.
+
+    openai  the hosted whisper-1 API (default)
+    local   faster-whisper (CTranslate2) on CPU with int8 weights, one model per
+            worker process; requires `pip install faster-whisper`
+
+Both return segments in the hosted API's verbose_json schema, offset by the
+chunk's start time, so the rest of the pipeline doesn't care which ran.
+transcribe_chunks yields (index, segments) as each chunk finishes, so callers
+can checkpoint it straight away.
+"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+from openai import OpenAI
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TRANSCRIPTION_BACKEND = os.environ.get("TRANSCRIPTION_BACKEND", "openai")
+LOCAL_WHISPER_MODEL = os.environ.get("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.environ.get("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_THREADS = int(os.environ.get("LOCAL_WHISPER_THREADS", 2))  # per worker
+LOCAL_WHISPER_WORKERS = int(
+    os.environ.get("LOCAL_WHISPER_WORKERS", max(1, (os.cpu_count() or 1) // LOCAL_WHISPER_THREADS))
+)
+
+
+class OpenAIWhisperBackend:
+    name = "openai"
+
+    def __init__(self):
+        self.client = OpenAI()
+        self.model = "whisper-1"
+
+    def transcribe_chunk(self, chunk_path: str, start_time: float = 0) -> Optional[List[Dict]]:
+        """Transcribe a single audio chunk."""
+        try:
+            with open(chunk_path, "rb") as audio_file:
+                transcript = self.client.audio.transcriptions.create(
+                    file=audio_file,
+                    model=self.model,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment"]
+                )
+
+            # Adjust timestamps based on chunk position
+            adjusted_segments = []
+            for segment in transcript.segments:
+                adjusted_segment = dict(segment)
+                adjusted_segment["start"] += start_time
+                adjusted_segment["end"] += start_time
+                adjusted_segments.append(adjusted_segment)
+
+            return adjusted_segments
+
+        except Exception as e:
+            logger.error(f"Error transcribing chunk {chunk_path}: {str(e)}")
+            return None
+
+    def transcribe_chunks(
+        self, chunks: List[Tuple[str, float]]
+    ) -> Iterator[Tuple[int, Optional[List[Dict]]]]:
+        """Transcribe (chunk_path, start_time) pairs, yielding (index, segments) in turn.
+
+        Failed chunks yield None.
+        """
+        for i, (chunk_path, start_time) in enumerate(chunks):
+            yield i, self.transcribe_chunk(chunk_path, start_time)
+
+    def close(self):
+        pass
+
+
+# Loaded once per worker process by init_local_worker
+worker_model = None
+
+
+def init_local_worker(model_name: str, compute_type: str, threads: int):
+    global worker_model
+    from faster_whisper import WhisperModel
+
+    worker_model = WhisperModel(
+        model_name, device="cpu", compute_type=compute_type, cpu_threads=threads
+    )
+
+
+def transcribe_local_chunk(chunk_path: str, start_time: float) -> Optional[List[Dict]]:
+    """Transcribe a chunk in a worker process, in the hosted API's segment schema."""
+    try:
+        segments, _ = worker_model.transcribe(chunk_path, beam_size=5)
+        return [
+            {
+                "id": segment.id,
+                "seek": segment.seek,
+                "start": segment.start + start_time,
+                "end": segment.end + start_time,
+                "text": segment.text,
+                "tokens": segment.tokens,
+                "temperature": segment.temperature,
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+            for segment in segments
+        ]
+    except Exception as e:
+        logger.error(f"Error transcribing chunk {chunk_path}: {str(e)}")
+        return None
+
+
+class LocalWhisperBackend:
+    name = "local"
+
+    def __init__(self):
+        self.model = f"faster-whisper-{LOCAL_WHISPER_MODEL}-{LOCAL_WHISPER_COMPUTE_TYPE}"
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        # Started on first use and reused across files, so models load once per worker
+        if self.pool is None:
+            logger.info(
+                f"Starting {LOCAL_WHISPER_WORKERS} local Whisper workers "
+                f"({LOCAL_WHISPER_THREADS} threads each, model {LOCAL_WHISPER_MODEL})"
+            )
+            self.pool = ProcessPoolExecutor(
+                max_workers=LOCAL_WHISPER_WORKERS,
+                initializer=init_local_worker,
+                initargs=(LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_THREADS),
+            )
+        return self.pool
+
+    def transcribe_chunk(self, chunk_path: str, start_time: float = 0) -> Optional[List[Dict]]:
+        _, segments = next(self.transcribe_chunks([(chunk_path, start_time)]))
+        return segments
+
+    def transcribe_chunks(
+        self, chunks: List[Tuple[str, float]]
+    ) -> Iterator[Tuple[int, Optional[List[Dict]]]]:
+        """Transcribe (chunk_path, start_time) pairs in parallel, yielding (index, segments)
+        in the order they finish.
+
+        Failed chunks yield None, including every unfinished one if a worker dies.
+        """
+        pool = self.get_pool()
+        futures = {
+            pool.submit(transcribe_local_chunk, chunk_path, start_time): i
+            for i, (chunk_path, start_time) in enumerate(chunks)
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    segments = future.result()
+                except BrokenProcessPool as e:
+                    # A crashed worker breaks the pool; start a fresh one next time
+                    logger.error(f"Error transcribing chunk {chunks[futures[future]][0]}: {str(e)}")
+                    self.pool = None
+                    segments = None
+                yield futures[future], segments
+        finally:
+            # Stopped early: don't leave queued chunks running in the background
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+BACKENDS = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    LocalWhisperBackend.name: LocalWhisperBackend,
+}
+
+
+def get_backend(name: str = TRANSCRIPTION_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TRANSCRIPTION_BACKEND: {name}")
+    return BACKENDS[name]()